@@ -13,7 +13,12 @@ setup(
     author_email="epavlov@mozilla.com",
     url="https://github.com/mozilla/taar_gcp_etl",
     license="MPL 2.0",
-    install_requires=[],
+    install_requires=[
+        "aiohttp>=3.7",
+        "google-cloud-bigquery-storage>=1.1.0",
+        "msgpack>=1.0",
+        "zstandard>=0.15",
+    ],
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Environment :: Web Environment :: Mozilla",
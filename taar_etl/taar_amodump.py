@@ -1,26 +1,28 @@
 #!/bin/env python
 
+import asyncio
 import click
 import json
 import logging
 import logging.config
 import typing
-from six.moves import urllib, queue
 from six import text_type
 from decouple import config
 
 from taar_etl.taar_utils import store_json_to_gcs
 
-import requests
-from requests_toolbelt.threaded import pool
-
 AMO_DUMP_BUCKET = "taar_models"
 AMO_DUMP_PREFIX = "addon_recommender"
 AMO_DUMP_FILENAME = "extended_addons_database.json"
 
 DEFAULT_AMO_REQUEST_URI = "https://addons.mozilla.org/api/v4/addons/search/"
+DEFAULT_AMO_VERSIONS_URI = "https://addons.mozilla.org/api/v4/addons/addon/%s/versions/"
 QUERY_PARAMS = "?app=firefox&sort=created&type=extension"
 
+# Request timeouts in seconds
+SEARCH_TIMEOUT = 30.0
+VERSIONS_TIMEOUT = 2.0
+
 logger = logging.getLogger("amo_database")
 
 
@@ -77,170 +79,180 @@ class AMOAddonInfo(JSONSchema):
 
 
 class AMODatabase:
-    def __init__(self, worker_count):
-        """
-        Just setup the page_count
-        """
-        self._max_processes = worker_count
+    """
+    Crawl the AMO search API for every extension and the creation date
+    of its first version.
 
-        uri = DEFAULT_AMO_REQUEST_URI + QUERY_PARAMS
-        response = requests.get(uri)
-        jdata = json.loads(response.content.decode("utf8"))
+    Requests are made with asyncio over one pool of keep-alive
+    connections, with at most `worker_count` requests in flight.  The
+    version pages of an addon are requested as soon as the search page
+    listing it is parsed, rather than after every search page is done.
+    Failed requests are retried `retries` times.
 
-        self._page_count = jdata["page_count"]
+    With a `cache`, pages are requested conditionally and unchanged
+    pages are read from the cache.
+    """
+
+    def __init__(
+        self,
+        worker_count,
+        retries=1,
+        search_uri=DEFAULT_AMO_REQUEST_URI,
+        versions_uri=DEFAULT_AMO_VERSIONS_URI,
+        cache=None,
+    ):
+        self._concurrency = worker_count
+        self._retries = retries
+        self._search_uri = search_uri
+        self._versions_uri = versions_uri
+        self._cache = cache
 
     def fetch_addons(self):
-        addon_map = self._fetch_pages()
-        self._fetch_versions(addon_map)
+        addon_map = asyncio.run(self._crawl())
         final_result = {}
         for k, v in list(addon_map.items()):
             if "first_create_date" in v:
                 final_result[k] = v
         logger.info("Final addon set includes %d addons." % len(final_result))
+        if self._cache is not None:
+            logger.info(
+                "Response cache: %(fresh)d fresh, %(not_modified)d not modified, "
+                "%(downloaded)d downloaded" % self._cache.stats
+            )
         return final_result
 
-    def _fetch_pages(self):
-        addon_map = {}
+    async def _crawl(self):
+        import aiohttp
 
-        urls = []
-        for i in range(1, self._page_count + 1):
-            url = "{0}{1}&page={2}".format(
-                DEFAULT_AMO_REQUEST_URI, QUERY_PARAMS, i
+        addon_map = {}
+        self._version_tasks = []
+        self._semaphore = asyncio.Semaphore(self._concurrency)
+        connector = aiohttp.TCPConnector(limit=self._concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            self._session = session
+
+            jdata = await self._get_json(self._search_page_url(1), SEARCH_TIMEOUT)
+            if jdata is None:
+                raise RuntimeError("Cannot fetch the first AMO search page")
+            page_count = jdata["page_count"]
+            logger.info("Processing %d AMO search pages" % page_count)
+
+            self._handle_search_page(jdata, addon_map)
+            await asyncio.gather(
+                *[
+                    self._fetch_search_page(page, addon_map)
+                    for page in range(2, page_count + 1)
+                ]
             )
-            urls.append(url)
-        logger.info("Processing AMO urls")
-        p = pool.Pool.from_urls(urls, num_processes=self._max_processes)
-        p.join_all()
-
-        self._handle_responses(p, addon_map)
-
-        # Try failed requests
-        exceptions = p.exceptions()
-        p = pool.Pool.from_exceptions(
-            exceptions, num_processes=self._max_processes
-        )
-        p.join_all()
-        self._handle_responses(p, addon_map)
-        return addon_map
-
-    def _fetch_versions(self, addon_map):
-
-        logger.info("Processing Version urls")
-
-        q = queue.Queue()
-        logger.info("Filling initial verson page queue")
-
-        def iterFactory(guid_map):
-            for guid in list(guid_map.keys()):
-                yield "https://addons.mozilla.org/api/v4/addons/addon/%s/versions/" % guid
-
-        def chunker(seq, size):
-            collector = []
-            for term in seq:
-                collector.append(term)
-                if len(collector) == size:
-                    yield collector
-                    collector = []
-
-            # Yield any dangling records we collected
-            if len(collector) > 0:
-                yield collector
-
-        total_processed_addons = 0
-        for chunk in chunker(iterFactory(addon_map), 500):
-            for i, url in enumerate(chunk):
-                q.put({"method": "GET", "url": url, "timeout": 2.0})
             logger.info(
-                "Queue setup - processing initial version page requests"
-            )
-            logger.info("%d requests to process" % q.qsize())
-
-            p = pool.Pool(q, num_processes=self._max_processes)
-            p.join_all()
-            logger.info("Pool completed - processing responses")
-            last_page_urls = self._handle_version_responses(p)
-            logger.info("Captured %d last page urls" % len(last_page_urls))
-            total_processed_addons += len(last_page_urls)
-
-            # Try processing the exceptions once
-            p = pool.Pool.from_exceptions(
-                p.exceptions(), num_processes=self._max_processes
+                "Search pages completed, waiting for %d version lookups"
+                % len(self._version_tasks)
             )
-            p.join_all()
-            last_page_urls.extend(self._handle_version_responses(p))
+            await asyncio.gather(*self._version_tasks)
+        return addon_map
 
-            # Now fetch the last version of each addon
-            logger.info("Processing last page urls: %d" % len(last_page_urls))
-            p = pool.Pool.from_urls(
-                last_page_urls, num_processes=self._max_processes
-            )
-            p.join_all()
+    def _search_page_url(self, page):
+        return "{0}{1}&page={2}".format(self._search_uri, QUERY_PARAMS, page)
 
-            self._handle_last_version_responses(p, addon_map)
+    async def _get_json(self, url, timeout):
+        """
+        GET `url` and decode its JSON body.  Returns None if the status
+        is not 200 or every attempt failed.
+        """
+        import aiohttp
 
-            # Try processing exceptions once
-            p = pool.Pool.from_exceptions(
-                p.exceptions(), num_processes=self._max_processes
-            )
-            p.join_all()
-            self._handle_last_version_responses(p, addon_map)
+        cached = await self._cache_io(self._cache.get, url) if self._cache is not None else None
+        if cached is not None and self._cache.is_fresh(cached):
+            self._cache.stats["fresh"] += 1
+            return json.loads(cached["body"])
 
-            logger.info(
-                "Processed %d addons with version info" % total_processed_addons
-            )
-
-    def _handle_last_version_responses(self, p, addon_map):
-        for i, resp in enumerate(p.responses()):
+        for attempt in range(self._retries + 1):
             try:
-                if resp.status_code == 200:
-                    jdata = json.loads(resp.content.decode("utf8"))
-                    results = jdata["results"]
-
-                    raw_guid = resp.url.split("addon/")[1].split("/versions")[0]
-                    guid = urllib.parse.unquote(raw_guid)
-                    create_date = results[-1]["files"][0]["created"]
-
-                    record = addon_map.get(guid, None)
-                    if record is not None:
-                        record["first_create_date"] = create_date
-            except Exception as e:
-                # Skip this record
-                logger.error(e)
-        return addon_map
+                content = await self._get(url, timeout, cached)
+                return None if content is None else json.loads(content)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.error("Attempt %d of %s failed: %r" % (attempt + 1, url, e))
+        return None
 
-    def _handle_responses(self, p, addon_map):
-        i = 0
-        for resp in p.responses():
-            try:
-                if resp.status_code == 200:
-                    jdata = json.loads(resp.content.decode("utf8"))
-                    results = jdata["results"]
-                    for record in results:
-                        if i % 500 == 0:
-                            logger.info("Still parsing  addons...")
-                        guid = record["guid"]
-                        addon_map[guid] = record
-                    i += 1
-            except Exception as e:
-                # Skip this record
-                logger.error(e)
-
-    def _handle_version_responses(self, p):
-        page_urls = []
-        for i, resp in enumerate(p.responses()):
-            try:
-                if resp.status_code == 200:
-                    jdata = json.loads(resp.content.decode("utf8"))
-                    page_count = int(jdata["page_count"])
-                    if page_count > 1:
-                        url = resp.url + "?page=%d" % page_count
-                    else:
-                        url = resp.url
-                    page_urls.append(url)
-            except Exception as e:
-                # Skip this record
-                logger.error(e)
-        return page_urls
+    async def _get(self, url, timeout, cached=None):
+        """
+        The body of `url` as text, revalidating the `cached` entry if
+        there is one.  Returns None if the status is not 200 or 304.
+        """
+        import aiohttp
+        from taar_etl.taar_http_cache import ResponseCache
+
+        async with self._semaphore:
+            async with self._session.get(
+                url,
+                headers=ResponseCache.conditional_headers(cached),
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as resp:
+                status = resp.status
+                headers = resp.headers
+                content = await resp.read() if status == 200 else None
+
+        # The cache is written once the connection is released
+        if status == 304 and cached is not None:
+            await self._cache_io(self._cache.revalidated, cached)
+            self._cache.stats["not_modified"] += 1
+            return cached["body"]
+        if status != 200:
+            return None
+        if self._cache is not None:
+            await self._cache_io(self._cache.store, url, headers, content)
+            self._cache.stats["downloaded"] += 1
+        return content.decode("utf8")
+
+    async def _cache_io(self, func, *args):
+        """Run the blocking cache call `func(*args)` in the default executor."""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _fetch_search_page(self, page, addon_map):
+        jdata = await self._get_json(self._search_page_url(page), SEARCH_TIMEOUT)
+        if jdata is not None:
+            self._handle_search_page(jdata, addon_map)
+
+    def _handle_search_page(self, jdata, addon_map):
+        try:
+            for record in jdata["results"]:
+                guid = record["guid"]
+                # Pages shift while new addons are created, so an addon
+                # may be listed twice.  The first record is kept as its
+                # version lookup may already have completed.
+                if guid in addon_map:
+                    continue
+                addon_map[guid] = record
+                self._version_tasks.append(
+                    asyncio.ensure_future(
+                        self._fetch_first_create_date(guid, addon_map)
+                    )
+                )
+                if len(self._version_tasks) % 500 == 0:
+                    logger.info("Still parsing addons...")
+        except Exception as e:
+            # Skip this page
+            logger.error(e)
+
+    async def _fetch_first_create_date(self, guid, addon_map):
+        """
+        Set `first_create_date` on the record of `guid` from the last
+        page of its versions, which lists the oldest version.
+        """
+        url = self._versions_uri % guid
+        jdata = await self._get_json(url, VERSIONS_TIMEOUT)
+        try:
+            if jdata is None:
+                return
+            page_count = int(jdata["page_count"])
+            if page_count > 1:
+                jdata = await self._get_json(url + "?page=%d" % page_count, VERSIONS_TIMEOUT)
+                if jdata is None:
+                    return
+            addon_map[guid]["first_create_date"] = jdata["results"][-1]["files"][0]["created"]
+        except Exception as e:
+            # Skip this record
+            logger.error(e)
 
 
 class Undefined:
@@ -293,12 +305,38 @@ def marshal(value, name, type_def):
 
 @click.command()
 @click.option("--date", required=True)
-@click.option("--workers", default=100)
+@click.option("--workers", default=100, help="Maximum number of concurrent requests to AMO")
 @click.option("--gcs-prefix", default=AMO_DUMP_PREFIX)
 @click.option("--gcs-bucket", default=AMO_DUMP_BUCKET)
-def main(date, workers, gcs_prefix, gcs_bucket):
-
-    amodb = AMODatabase(int(workers))
+@click.option(
+    "--cache-dir",
+    help="Directory of a persistent cache of AMO responses. Pages are then requested "
+         "conditionally and unchanged pages are not downloaded again.",
+)
+@click.option(
+    "--cache-max-age",
+    type=int,
+    default=0,
+    help="Use cached pages younger than this many seconds without any request, "
+         "e.g. to rerun a failed dump.",
+)
+@click.option(
+    "--cache-prune-days",
+    type=int,
+    default=30,
+    help="Remove cached pages not fetched or revalidated in this many days, "
+         "such as the versions of addons no longer listed. 0 keeps every page.",
+)
+def main(date, workers, gcs_prefix, gcs_bucket, cache_dir, cache_max_age, cache_prune_days):
+    from taar_etl.taar_http_cache import ResponseCache
+
+    cache = None
+    if cache_dir:
+        cache = ResponseCache(cache_dir, cache_max_age)
+        if cache_prune_days:
+            pruned = cache.prune(cache_prune_days * 24 * 60 * 60)
+            logger.info("Pruned %d cached pages older than %d days" % (pruned, cache_prune_days))
+    amodb = AMODatabase(int(workers), cache=cache)
     addon_map = amodb.fetch_addons()
 
     try:
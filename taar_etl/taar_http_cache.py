@@ -0,0 +1,111 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Persistent on-disk cache of HTTP responses, keyed by URL.
+
+Each entry keeps the body of the last 200 response with its ETag and
+Last-Modified validators.  `conditional_headers` turns them into
+If-None-Match / If-Modified-Since headers, so a server answers 304
+without a body when the page did not change and the cached body is
+used instead.  Entries younger than `max_age` seconds are used without
+any request, which makes a rerun shortly after a failure nearly free.
+
+Entries are written atomically, so a crash never leaves a body paired
+with the validators of another version.  `prune` removes the entries
+which were not fetched or revalidated for a while, such as those of
+pages which are no longer requested.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+
+class ResponseCache:
+    def __init__(self, directory, max_age=0, clock=time.time):
+        self._directory = directory
+        self._max_age = max_age
+        self._clock = clock
+        self.stats = {"fresh": 0, "not_modified": 0, "downloaded": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url):
+        key = hashlib.sha256(url.encode("utf8")).hexdigest()
+        return os.path.join(self._directory, key[:2], key + ".json")
+
+    def get(self, url):
+        """The cached entry of `url`, or None."""
+        try:
+            with open(self._path(url), "r", encoding="utf8") as fin:
+                entry = json.load(fin)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("url") == url else None
+
+    def is_fresh(self, entry):
+        return self._max_age > 0 and self._clock() - entry["fetched_at"] < self._max_age
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Request headers revalidating `entry`."""
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url, headers, body):
+        """Cache `body` of a 200 response to `url` with its `headers` validators."""
+        self._write(
+            {
+                "url": url,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "fetched_at": self._clock(),
+                "body": body.decode("utf8"),
+            }
+        )
+
+    def revalidated(self, entry):
+        """Record that the server confirmed `entry` is unchanged."""
+        entry = dict(entry, fetched_at=self._clock())
+        self._write(entry)
+        return entry
+
+    def prune(self, max_age):
+        """
+        Remove the entries written more than `max_age` seconds ago.
+        Returns the number of entries removed.
+        """
+        cutoff = self._clock() - max_age
+        removed = 0
+        for root, _, fnames in os.walk(self._directory):
+            for fname in fnames:
+                path = os.path.join(root, fname)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.unlink(path)
+                        removed += 1
+                except OSError:
+                    # Removed or replaced concurrently
+                    continue
+        return removed
+
+    def _write(self, entry):
+        path = self._path(entry["url"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf8") as fout:
+                json.dump(entry, fout)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
@@ -0,0 +1,184 @@
+"""
+Benchmarks of the hot path of taar_profile_bigtable: the Dataflow
+transforms and every payload codec.
+
+Records come from the seeded `SyntheticProfiles` generator, or from
+local Avro files with `--avro-glob`, so this runs fully offline and two
+revisions of the code can be compared on identical input.  For each
+transform and codec the throughput, the bytes per row and the peak
+Python memory allocated while processing the records are reported.
+`--json-output` saves the results for later comparison.
+
+tests/test_profile_benchmark.py runs the same transforms and codecs
+under pytest-benchmark, which can compare runs with
+`--benchmark-autosave` and `--benchmark-compare`.
+"""
+
+import copy
+import json
+import time
+import tracemalloc
+
+import click
+
+from taar_etl.taar_profile_bigtable import (
+    create_bigtable_rows,
+    delete_bigtable_rows,
+    explode_active_addons,
+)
+from taar_etl.taar_profile_codec import (
+    CODECS,
+    count_addon_vocabulary,
+    decode_payload,
+    get_codec,
+    profile_payload,
+    register_decoder,
+    train_zstd_dictionary,
+    ZSTD_DICT_MIN_SAMPLES,
+)
+from taar_etl.taar_profile_synthetic import SyntheticProfiles
+from taar_etl.taar_profile_transforms import CreateBigTableRowsFn
+
+
+def measure(label, build, make_inputs, size=None):
+    """
+    Run `build` on every record returned by `make_inputs`, once timed
+    and once under tracemalloc while keeping the outputs.  `size` maps
+    an output to its size in bytes.
+    """
+    records = make_inputs()
+    start = time.perf_counter()
+    for rec in records:
+        build(rec)
+    elapsed = time.perf_counter() - start
+
+    records = make_inputs()
+    tracemalloc.start()
+    outputs = [build(rec) for rec in records]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "rows_per_sec": len(records) / max(elapsed, 1e-9),
+        "peak_memory_bytes": peak,
+        "bytes_per_row": sum(size(out) for out in outputs) / len(outputs) if size and outputs else None,
+    }
+    line = f"{label:<24}: {result['rows_per_sec']:12.0f} rows/sec {peak / 1024:10.0f} KiB peak"
+    if result["bytes_per_row"] is not None:
+        line += f" {result['bytes_per_row']:8.1f} bytes/row"
+    print(line)
+    return result
+
+
+def row_size(direct_rows):
+    return sum(direct_row.get_mutations_size() for direct_row in direct_rows)
+
+
+def codec_options(profiles):
+    """
+    The options of the codecs which need a dictionary or vocabulary,
+    built from the first half of `profiles`.  zstd-dict is left out when
+    that half is too small to train a dictionary on.
+    """
+    training = profiles[: len(profiles) // 2]
+    options = {"msgpack-addon-ids": {"vocabulary": count_addon_vocabulary(training)}}
+    if len(training) >= ZSTD_DICT_MIN_SAMPLES:
+        options["zstd-dict"] = {"dictionary": train_zstd_dictionary(training)}
+    else:
+        print(f"Skipping zstd-dict: fewer than {2 * ZSTD_DICT_MIN_SAMPLES} records")
+    return options
+
+
+def usable_codecs(options, names=None):
+    """`names` (every codec by default) without those `options` left out."""
+    return [
+        name for name in (names or sorted(CODECS))
+        if name != "zstd-dict" or name in options
+    ]
+
+
+def load_records(avro_glob, rows, seed, mean_addons, null_rate):
+    if avro_glob:
+        import glob
+        import itertools
+        from taar_etl.taar_profile_bulk_load import iter_shard_records
+
+        shards = sorted(glob.glob(avro_glob))
+        records = itertools.chain.from_iterable(iter_shard_records(shard) for shard in shards)
+        return list(itertools.islice(records, rows))
+    return list(
+        SyntheticProfiles(rows, seed=seed, mean_addons=mean_addons, null_rate=null_rate)
+    )
+
+
+@click.command()
+@click.option("--rows", type=click.IntRange(min=1), default=20000, help="Number of records")
+@click.option("--seed", type=int, default=42)
+@click.option("--mean-addons", type=float, default=6, help="Mean number of addons per record")
+@click.option("--null-rate", type=float, default=0.02, help="Rate of null nullable columns")
+@click.option("--avro-glob", help="Benchmark on records read from local Avro files instead")
+@click.option("--json-output", help="Write the results as JSON to this path")
+def main(rows, seed, mean_addons, null_rate, avro_glob, json_output):
+    import datetime
+
+    records = load_records(avro_glob, rows, seed, mean_addons, null_rate)
+    if not records:
+        raise click.ClickException(f"No records in {avro_glob}")
+    print(f"Benchmarking on {len(records)} records")
+    results = {"rows": len(records), "seed": seed, "avro_glob": avro_glob, "transforms": {}, "codecs": {}}
+    transforms = results["transforms"]
+
+    # create_bigtable_rows hashes the client_id in place
+    transforms["create_bigtable_rows"] = measure(
+        "create_bigtable_rows",
+        create_bigtable_rows,
+        lambda: copy.deepcopy(records),
+        lambda direct_row: row_size([direct_row]),
+    )
+
+    dofn = CreateBigTableRowsFn(datetime.datetime.utcnow())
+    dofn.setup()
+    transforms["CreateBigTableRowsFn"] = measure(
+        "CreateBigTableRowsFn",
+        lambda rec: list(dofn.process(rec)),
+        lambda: records,
+        row_size,
+    )
+    speedup = (
+        transforms["CreateBigTableRowsFn"]["rows_per_sec"]
+        / transforms["create_bigtable_rows"]["rows_per_sec"]
+    )
+    print(f"Speedup                 : {speedup:12.2f}x")
+
+    transforms["explode_active_addons"] = measure(
+        "explode_active_addons",
+        explode_active_addons,
+        lambda: records,
+        lambda obj: len(json.dumps(obj)),
+    )
+    transforms["delete_bigtable_rows"] = measure(
+        "delete_bigtable_rows",
+        delete_bigtable_rows,
+        lambda: records,
+        lambda direct_row: row_size([direct_row]),
+    )
+
+    profiles = [profile_payload(rec) for rec in records]
+    options = codec_options(profiles)
+    for name in usable_codecs(options):
+        codec = get_codec(name, **options.get(name, {}))
+        register_decoder(codec)
+        payloads = [codec.encode(rec) for rec in profiles]
+        results["codecs"][name] = {
+            "encode": measure(f"{name} encode", codec.encode, lambda: profiles, len),
+            "decode": measure(f"{name} decode", decode_payload, lambda: payloads),
+        }
+
+    if json_output:
+        with open(json_output, "w") as fout:
+            json.dump(results, fout, indent=2, sort_keys=True)
+        print(f"Wrote results to {json_output}")
+
+
+if __name__ == "__main__":
+    main()
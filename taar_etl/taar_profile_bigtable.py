@@ -1,10 +1,300 @@
 import click
 
+from taar_etl.taar_profile_codec import (
+    CODECS,
+    DEFAULT_CODEC,
+    HASHED_CLIENT_ID,
+    profile_row_key,
+)
+from taar_etl.taar_profile_index import (
+    DEFAULT_INDEX_BITS,
+    ROW_KEY_INDEX_BUCKET,
+    ROW_KEY_INDEX_DAYS,
+    row_key_index_path,
+)
+
+# Trained zstd dictionaries must outlive the Avro bucket, which is
+# cleared on every DAG run, so they are stored with the other models.
+ZSTD_DICT_BUCKET = "taar_models"
+ZSTD_DICT_PREFIX = "taar/profile/zstd_dict"
+
+# The addon vocabulary of the msgpack-addon-ids codec is published next
+# to the AMO dumps, as <fname>.bz2 and <fname>.<YYYYMMDD>.bz2
+ADDON_VOCABULARY_BUCKET = "taar_models"
+ADDON_VOCABULARY_PREFIX = "addon_recommender"
+ADDON_VOCABULARY_FNAME = "addon_vocabulary.json"
+
+
+SAMPLING_MODES = ("random", "deterministic")
+
+# Where load_bigtable reads profiles from: the Avro export on GCS, or
+# the BigQuery temporary table through the Storage Read API.
+LOAD_SOURCES = ("avro", "bigquery-storage")
+
+# Resolution of the deterministic sampling buckets
+SAMPLE_BUCKETS = 1000000
+
+# Fields of the active_addons structs of clients_last_seen, which
+# --addon-fields may project
+ACTIVE_ADDON_FIELDS = (
+    "addon_id",
+    "blocklisted",
+    "name",
+    "user_disabled",
+    "app_disabled",
+    "version",
+    "scope",
+    "type",
+    "foreign_install",
+    "has_binary_components",
+    "install_day",
+    "update_day",
+    "signed_state",
+    "is_system",
+    "is_web_extension",
+    "multiprocess_compatible",
+)
+
+# The sampling salt is part of a SQL string literal, so it is limited
+# to characters which need no escaping
+SAMPLE_SALT_PATTERN = r"[A-Za-z0-9_-]*"
+
+
+def avro_shard_prefix(iso_date):
+    return f"""taar-profile.{iso_date}.avro."""
+
 
 def gcs_avro_uri(gcs_bucket, iso_date):
     # Export of BigQuery into Avro uses GCS_AVRO_URI as the template for
     # filenames.
-    return f"""gs://{gcs_bucket}/taar-profile.{iso_date}.avro.*"""
+    return f"""gs://{gcs_bucket}/{avro_shard_prefix(iso_date)}*"""
+
+
+def list_avro_shards(gcs_bucket, iso_date):
+    """Names of the Avro shards exported for `iso_date`, in order."""
+    from google.cloud import storage
+
+    client = storage.Client()
+    blobs = client.list_blobs(gcs_bucket, prefix=avro_shard_prefix(iso_date))
+    return sorted(blob.name for blob in blobs)
+
+
+def list_avro_shard_checksums(gcs_bucket, iso_date):
+    """Name and MD5 of every Avro shard exported for `iso_date`, in order."""
+    from google.cloud import storage
+
+    client = storage.Client()
+    blobs = client.list_blobs(gcs_bucket, prefix=avro_shard_prefix(iso_date))
+    return sorted((blob.name, blob.md5_hash) for blob in blobs)
+
+
+def read_avro_shard(gcs_bucket, blob_name):
+    """Yield every record of one Avro shard stored in GCS."""
+    import tempfile
+    import fastavro
+    from google.cloud import storage
+
+    client = storage.Client()
+    blob = client.bucket(gcs_bucket).blob(blob_name)
+    # Spool the shard to local disk rather than memory: shards are
+    # several hundred MB and workers read a few of them at once.
+    with tempfile.TemporaryFile() as tmpfile:
+        blob.download_to_file(tmpfile)
+        tmpfile.seek(0)
+        for record in fastavro.reader(tmpfile):
+            yield record
+
+
+# Fingerprint manifests of previous loads are needed by the next day's
+# run, so like the zstd dictionaries they live outside the Avro bucket.
+FINGERPRINT_BUCKET = "taar_models"
+FINGERPRINT_PREFIX = "taar/profile/fingerprints"
+
+
+# The Parquet export is read by model training after the Avro bucket
+# has been wiped, so it is kept with the other long lived artifacts.
+PARQUET_BUCKET = "taar_models"
+PARQUET_PREFIX = "taar/profile/parquet"
+
+
+# High-watermark of the deletion requests already applied to BigTable
+OPT_OUT_WATERMARK_BUCKET = "taar_models"
+OPT_OUT_WATERMARK_PATH = "taar/profile/opt_out_watermark.json"
+# Deletion requests can land in BigQuery after newer ones, so the
+# watermark is moved back by this many days before it is applied
+OPT_OUT_WATERMARK_LAG_DAYS = 1
+
+
+def read_opt_out_watermark(bucket):
+    """
+    Return the submission_timestamp (ISO 8601 string) of the last
+    processed deletion request, or None if no watermark was stored.
+    """
+    import json
+    from google.api_core.exceptions import NotFound
+    from taar_etl.taar_utils import read_bytes_from_gcs
+
+    try:
+        jdata = json.loads(read_bytes_from_gcs(bucket, OPT_OUT_WATERMARK_PATH))
+    except NotFound:
+        return None
+    return jdata["submission_timestamp"]
+
+
+def store_opt_out_watermark(bucket, submission_timestamp, iso_date):
+    import json
+    from taar_etl.taar_utils import store_bytes_to_gcs
+
+    jdata = {"submission_timestamp": submission_timestamp, "iso_date": iso_date}
+    store_bytes_to_gcs(bucket, OPT_OUT_WATERMARK_PATH, json.dumps(jdata).encode("utf8"))
+
+
+def zstd_dict_path(dict_id):
+    return f"{ZSTD_DICT_PREFIX}/{dict_id}.zdict"
+
+
+def addon_vocabulary_path(vocabulary_id):
+    return f"{ADDON_VOCABULARY_PREFIX}/addon_vocabularies/{vocabulary_id}.json.bz2"
+
+
+def read_addon_vocabulary(vocabulary_id, vocabulary_bucket=ADDON_VOCABULARY_BUCKET):
+    """The addon vocabulary published under `vocabulary_id`."""
+    import bz2
+    import json
+    from taar_etl.taar_utils import read_bytes_from_gcs
+
+    data = read_bytes_from_gcs(vocabulary_bucket, addon_vocabulary_path(vocabulary_id))
+    return json.loads(bz2.decompress(data).decode("utf8"))
+
+
+def codec_salt(payload_codec, codec_options):
+    """Identify the payload encoding, including the state the codec encodes with."""
+    from taar_etl.taar_profile_codec import zstd_dictionary_id
+
+    salt = payload_codec
+    if "dictionary" in codec_options:
+        salt += f":{zstd_dictionary_id(codec_options['dictionary'])}"
+    if "vocabulary" in codec_options:
+        salt += f":{codec_options['vocabulary']['id']}"
+    return salt
+
+
+def fingerprint_manifest_prefix(iso_date):
+    return f"{FINGERPRINT_PREFIX}/{iso_date}/"
+
+
+def previous_fingerprint_manifest(fingerprint_bucket, iso_date):
+    """
+    Return the GCS glob of the most recent completed fingerprint
+    manifest written before `iso_date`, or None if there is none.
+    A manifest is only complete once its `_SUCCESS` marker exists.
+    """
+    from google.cloud import storage
+
+    client = storage.Client()
+    completed = []
+    for blob in client.list_blobs(fingerprint_bucket, prefix=f"{FINGERPRINT_PREFIX}/"):
+        manifest_date, _, fname = blob.name[len(FINGERPRINT_PREFIX) + 1:].partition("/")
+        if fname == "_SUCCESS" and manifest_date < iso_date:
+            completed.append(manifest_date)
+    if not completed:
+        return None
+    latest = max(completed)
+    return f"gs://{fingerprint_bucket}/{fingerprint_manifest_prefix(latest)}fingerprints*"
+
+
+# Row keys are uniform SHA256 hex digests, so a new profile table is
+# pre-split into equal ranges of the hex key space, one tablet per
+# ROWS_PER_SPLIT expected rows.
+ROWS_PER_SPLIT = 250000
+MAX_INITIAL_SPLITS = 100
+
+# Rows buffered and sorted by key before they are written, per bundle
+DEFAULT_SORT_BUFFER_SIZE = 10000
+
+
+def profile_split_keys(expected_rows, rows_per_split=ROWS_PER_SPLIT, max_splits=MAX_INITIAL_SPLITS):
+    """
+    Split keys dividing the hex row key space into equal ranges of
+    about `rows_per_split` rows for `expected_rows` rows, using at most
+    `max_splits` keys.
+    """
+    if not expected_rows:
+        return []
+    ranges = min(expected_rows // rows_per_split, max_splits + 1)
+    if ranges < 2:
+        return []
+    # One more hex digit than needed to number the ranges keeps the
+    # split keys distinct and evenly spaced
+    width = len(format(ranges - 1, "x")) + 1
+    space = 16 ** width
+    return [
+        format(i * space // ranges, f"0{width}x").encode("utf8")
+        for i in range(1, ranges)
+    ]
+
+
+# Summaries of the Beam metrics of each Dataflow job are kept with the
+# other long lived artifacts so that runs can be compared over time.
+METRICS_BUCKET = "taar_models"
+METRICS_PREFIX = "taar/profile/metrics"
+METRICS_NAMESPACE = "taar_profile"
+
+# The uncompressed JSON size is measured on one payload in this many
+PAYLOAD_SIZE_SAMPLE_EVERY = 100
+
+
+def default_metrics_output(iso_date):
+    return f"gs://{METRICS_BUCKET}/{METRICS_PREFIX}/{iso_date}"
+
+
+def pipeline_metrics_summary(result):
+    """
+    Collect the counters and distributions of the `taar_profile`
+    namespace from a finished pipeline, merged across steps.
+    """
+    from apache_beam.metrics.metric import MetricsFilter
+
+    metrics = result.metrics().query(
+        MetricsFilter().with_namespace(METRICS_NAMESPACE)
+    )
+
+    def value(metric):
+        # Not every runner reports committed values
+        return metric.attempted if metric.committed is None else metric.committed
+
+    counters = {}
+    for metric in metrics["counters"]:
+        name = metric.key.metric.name
+        counters[name] = counters.get(name, 0) + value(metric)
+
+    distributions = {}
+    for metric in metrics["distributions"]:
+        name = metric.key.metric.name
+        data = value(metric)
+        merged = distributions.setdefault(
+            name, {"count": 0, "sum": 0, "min": None, "max": None}
+        )
+        if not data.count:
+            continue
+        merged["count"] += data.count
+        merged["sum"] += data.sum
+        merged["min"] = data.min if merged["min"] is None else min(merged["min"], data.min)
+        merged["max"] = data.max if merged["max"] is None else max(merged["max"], data.max)
+    for merged in distributions.values():
+        merged["mean"] = merged["sum"] / merged["count"] if merged["count"] else None
+
+    return {"counters": counters, "distributions": distributions}
+
+
+def write_metrics_summary(summary, uri):
+    """Write `summary` as JSON to a local path or a gs:// URI."""
+    import json
+    from apache_beam.io.filesystems import FileSystems
+
+    with FileSystems.create(uri) as fout:
+        fout.write(json.dumps(summary, indent=2, sort_keys=True).encode("utf8"))
+    return uri
 
 
 # Construct a BigQuery client object.
@@ -20,7 +310,15 @@ class ProfileDataExtraction:
             bigtable_table_id,
             sample_rate,
             subnetwork,
+            hash_in_bigquery=False,
+            addon_fields=None,
+            drop_system_addons=False,
+            drop_disabled_addons=False,
+            sampling="random",
+            sample_salt="",
+            start_date=None,
     ):
+        import re
         from datetime import datetime
 
         # The GCP project that houses the BigTable database of TAAR user profiles
@@ -42,6 +340,16 @@ class ProfileDataExtraction:
             "%Y-%m-%d"
         )
 
+        # Backfills export the latest profile of each client seen from
+        # `start_date` to `date` in one run, tagged with `date`
+        if start_date is not None and start_date > date:
+            raise ValueError(f"Start date {start_date} is after {date}")
+        self.START_DATE_DASH = None
+        if start_date is not None and start_date != date:
+            self.START_DATE_DASH = datetime.strptime(start_date, "%Y%m%d").strftime(
+                "%Y-%m-%d"
+            )
+
         self.GCP_PROJECT = gcp_project
 
         # Avro files are imported into Cloud BigTable.  Instance and Table ID
@@ -51,8 +359,35 @@ class ProfileDataExtraction:
 
         self.SAMPLE_RATE = sample_rate
 
+        # "random" draws a new sample every day, "deterministic" keeps
+        # the same clients in the sample from one day to the next.
+        # Changing the salt rotates the deterministic sample.
+        if sampling not in SAMPLING_MODES:
+            raise ValueError(f"Unknown sampling mode {sampling}")
+        if not re.fullmatch(SAMPLE_SALT_PATTERN, sample_salt):
+            raise ValueError(f"The sample salt must match {SAMPLE_SALT_PATTERN}")
+        self.SAMPLING = sampling
+        self.SAMPLE_SALT = sample_salt
+
         self.SUBNETWORK = subnetwork
 
+        # Hash client_ids and cast numeric columns to integers in
+        # BigQuery rather than on the Dataflow workers.  Raw client_ids
+        # then never leave BigQuery.
+        self.HASH_IN_BIGQUERY = hash_in_bigquery
+
+        # Fields of the active_addons structs to keep (None keeps all of
+        # them) and which addons to drop before the export
+        if addon_fields is not None:
+            unknown = [field for field in addon_fields if field not in ACTIVE_ADDON_FIELDS]
+            if unknown:
+                raise ValueError(f"Unknown active_addons fields {', '.join(unknown)}")
+            if "addon_id" not in addon_fields:
+                raise ValueError("addon_id must be part of the active_addons projection")
+        self.ADDON_FIELDS = addon_fields
+        self.DROP_SYSTEM_ADDONS = drop_system_addons
+        self.DROP_DISABLED_ADDONS = drop_disabled_addons
+
     def run_query(self, sql):
         from google.cloud import bigquery
 
@@ -67,28 +402,120 @@ class ProfileDataExtraction:
             rows.append(row)
         return rows
 
+    def client_id_sql(self, column="client_id"):
+        if self.HASH_IN_BIGQUERY:
+            # Matches hashlib.sha256(client_id.encode("utf8")).hexdigest()
+            return f"TO_HEX(SHA256({column})) as {HASHED_CLIENT_ID}"
+        return column
+
+    def addon_filter_sql(self):
+        """SQL predicate on `addon` selecting the addons to export, or None."""
+        predicates = []
+        if self.DROP_SYSTEM_ADDONS:
+            predicates.append("NOT COALESCE(addon.is_system, FALSE)")
+        if self.DROP_DISABLED_ADDONS:
+            predicates.append("NOT COALESCE(addon.user_disabled, FALSE)")
+            predicates.append("NOT COALESCE(addon.app_disabled, FALSE)")
+        return " AND ".join(predicates) or None
+
+    def active_addons_sql(self):
+        addon_filter = self.addon_filter_sql()
+        if self.ADDON_FIELDS is None and addon_filter is None:
+            return "active_addons"
+
+        if self.ADDON_FIELDS is None:
+            select = "addon"
+        else:
+            select = "AS STRUCT " + ", ".join(
+                f"addon.{field}" for field in self.ADDON_FIELDS
+            )
+        where = f" WHERE {addon_filter}" if addon_filter else ""
+        return f"ARRAY(SELECT {select} FROM UNNEST(active_addons) AS addon{where}) as active_addons"
+
+    def sample_sql(self):
+        if self.SAMPLING == "deterministic":
+            # MOD before ABS: ABS of the smallest INT64 overflows
+            threshold = int(round(self.SAMPLE_RATE * SAMPLE_BUCKETS))
+            return (
+                f"ABS(MOD(FARM_FINGERPRINT(CONCAT(client_id, '{self.SAMPLE_SALT}')), "
+                f"{SAMPLE_BUCKETS})) < {threshold}"
+            )
+        return f"RAND() < {self.SAMPLE_RATE}"
+
+    def source_sql(self):
+        """
+        The clients_last_seen rows to export and the predicate selecting
+        them: the sampled rows of one day, or the latest row of each
+        sampled client over the backfilled date range.
+        """
+        table = "`moz-fx-data-shared-prod`.telemetry.clients_last_seen"
+        if self.START_DATE_DASH is None:
+            return table, f"{self.sample_sql()}\n                and submission_date = '{self.ISODATE_DASH}'"
+        # A deterministic sample only depends on client_id, so it is
+        # applied before the window function ranks each client's rows.
+        # A random one has to pick among the latest rows.
+        inner_sample = ""
+        predicate = "profile_rank = 1"
+        if self.SAMPLING == "deterministic":
+            inner_sample = f"\n                        and {self.sample_sql()}"
+        else:
+            predicate = f"{self.sample_sql()}\n                and {predicate}"
+        latest = f"""(
+                    select
+                        *,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY client_id ORDER BY submission_date DESC
+                        ) as profile_rank
+                    from
+                        {table}
+                    where
+                        submission_date between '{self.START_DATE_DASH}' and '{self.ISODATE_DASH}'{inner_sample}
+                )"""
+        return latest, predicate
+
     def insert_sql(self):
+        # Clients left without any addon once filtered are not exported
+        addon_filter = self.addon_filter_sql()
+        has_addons = "array_length(active_addons) > 0"
+        if addon_filter:
+            has_addons = f"EXISTS(SELECT 1 FROM UNNEST(active_addons) AS addon WHERE {addon_filter})"
+
+        subsession_length = "SAFE_CAST(subsession_hours_sum * 3600 as int64)"
+        numeric_columns = {
+            "bookmark_count": "places_bookmarks_count_mean",
+            "tab_open_count": "scalar_parent_browser_engagement_tab_open_event_count_sum",
+            "total_uri": "scalar_parent_browser_engagement_total_uri_count_sum",
+            "unique_tlds": "scalar_parent_browser_engagement_unique_domains_count_mean",
+        }
+        if self.HASH_IN_BIGQUERY:
+            # TRUNC and COALESCE mirror int(value or 0) in profile_payload
+            subsession_length = f"COALESCE({subsession_length}, 0)"
+            numeric_columns = {
+                name: f"COALESCE(SAFE_CAST(TRUNC({expr}) as int64), 0)"
+                for name, expr in numeric_columns.items()
+            }
+        numeric_sql = ",\n                ".join(
+            f"{expr} as {name}" for name, expr in numeric_columns.items()
+        )
+        source, source_predicate = self.source_sql()
+
         return f"""
         CREATE OR REPLACE TABLE
             `{self.GCP_PROJECT}`.{self.BIGQUERY_DATASET_ID}.{self.BIGQUERY_TABLE_ID}
         as (
             select
-                client_id,
+                {self.client_id_sql()},
                 city as geo_city,
-                SAFE_CAST(subsession_hours_sum * 3600 as int64) as subsession_length,
+                {subsession_length} as subsession_length,
                 locale,
                 os,
-                active_addons,
-                places_bookmarks_count_mean as bookmark_count,
-                scalar_parent_browser_engagement_tab_open_event_count_sum as tab_open_count,
-                scalar_parent_browser_engagement_total_uri_count_sum as total_uri,
-                scalar_parent_browser_engagement_unique_domains_count_mean as unique_tlds
+                {self.active_addons_sql()},
+                {numeric_sql}
             from
-                `moz-fx-data-shared-prod`.telemetry.clients_last_seen
+                {source}
             where
-                array_length(active_addons) > 0
-                and RAND() < {self.SAMPLE_RATE}
-                and submission_date = '{self.ISODATE_DASH}'
+                {has_addons}
+                and {source_predicate}
         )
         """
 
@@ -131,7 +558,74 @@ class ProfileDataExtraction:
         )  # API request
         extract_job.result()  # Waits for job to complete.
 
-    def create_table_in_bigtable(self):
+    def publish_metrics(self, result, job, metrics_output=None):
+        """
+        Print the metrics summary of a finished pipeline and write it to
+        `<metrics_output>/<job>.json`.
+        """
+        import json
+
+        summary = pipeline_metrics_summary(result)
+        summary.update(
+            {"job": job, "iso_date": self.ISODATE_NODASH, "state": str(result.state)}
+        )
+        output = metrics_output or default_metrics_output(self.ISODATE_NODASH)
+        uri = write_metrics_summary(summary, f"{output.rstrip('/')}/{job}.json")
+        print(json.dumps(summary, indent=2, sort_keys=True))
+        print(f"Wrote pipeline metrics to {uri}")
+        return summary
+
+    def bigtable_writer(self, max_num_workers=1, mutations_per_second=None, bytes_per_second=None):
+        """
+        The transform writing DirectRows to the profile table.  With a
+        `mutations_per_second` or `bytes_per_second` budget, split evenly
+        across the workers, rows go through `WriteBigTableRowsFn`
+        instead of WriteToBigTable.  The pipeline must then run a single
+        SDK process per worker (see `get_dataflow_options`), since the
+        share of each worker is enforced per process.
+        """
+        import apache_beam as beam
+        from apache_beam.io.gcp.bigtableio import WriteToBigTable
+        from taar_etl.taar_profile_transforms import WriteBigTableRowsFn
+
+        if not mutations_per_second and not bytes_per_second:
+            return WriteToBigTable(
+                project_id=self.GCP_PROJECT,
+                instance_id=self.BIGTABLE_INSTANCE_ID,
+                table_id=self.BIGTABLE_TABLE_ID,
+            )
+        return beam.ParDo(
+            WriteBigTableRowsFn(
+                self.GCP_PROJECT,
+                self.BIGTABLE_INSTANCE_ID,
+                self.BIGTABLE_TABLE_ID,
+                mutations_per_second / max_num_workers if mutations_per_second else None,
+                bytes_per_second / max_num_workers if bytes_per_second else None,
+            )
+        )
+
+    def expected_row_count(self):
+        """
+        Number of profiles in the BigQuery temporary table, or None if
+        the table is gone.
+        """
+        from google.api_core.exceptions import NotFound
+        from google.cloud import bigquery
+
+        try:
+            table = bigquery.Client().get_table(
+                f"{self.GCP_PROJECT}.{self.BIGQUERY_DATASET_ID}.{self.BIGQUERY_TABLE_ID}"
+            )
+        except NotFound:
+            return None
+        return table.num_rows
+
+    def create_table_in_bigtable(self, expected_rows=None):
+        """
+        Create the profile table if it does not exist, pre-split for
+        `expected_rows` rows.  The row count of the BigQuery temporary
+        table is used when `expected_rows` is not set.
+        """
         from google.cloud import bigtable
         from google.cloud.bigtable import column_family
         from google.cloud.bigtable import row_filters
@@ -160,14 +654,217 @@ class ProfileDataExtraction:
         column_family_id = "profile"
         column_families = {column_family_id: gc_rule}
         if not table.exists():
-            table.create(column_families=column_families)
+            if expected_rows is None:
+                expected_rows = self.expected_row_count()
+            split_keys = profile_split_keys(expected_rows)
+            print(f"Pre-splitting into {len(split_keys) + 1} tablets for {expected_rows} rows")
+            table.create(initial_split_keys=split_keys, column_families=column_families)
             print(f"Created {column_family_id}")
 
-    def load_bigtable(self, max_num_workers=1, dataflow_service_account=None):
+    def train_zstd_dictionary(
+            self, sample_size, dict_size, dict_bucket=ZSTD_DICT_BUCKET
+    ):
+        """
+        Train a zstd dictionary on up to `sample_size` profiles read from
+        the Avro export and publish it to GCS, both under its dictionary
+        id and as `latest`.  Returns the dictionary id.
+        """
+        from taar_etl.taar_profile_codec import (
+            profile_payload,
+            train_zstd_dictionary,
+            zstd_dictionary_id,
+        )
+        from taar_etl.taar_utils import store_bytes_to_gcs
+
+        profiles = []
+        for shard in list_avro_shards(self.GCS_BUCKET, self.ISODATE_NODASH):
+            for record in read_avro_shard(self.GCS_BUCKET, shard):
+                profiles.append(profile_payload(record))
+                if len(profiles) >= sample_size:
+                    break
+            if len(profiles) >= sample_size:
+                break
+        print(f"Training zstd dictionary on {len(profiles)} profiles")
+
+        dictionary = train_zstd_dictionary(profiles, dict_size)
+        dict_id = zstd_dictionary_id(dictionary)
+        store_bytes_to_gcs(dict_bucket, zstd_dict_path(dict_id), dictionary)
+        store_bytes_to_gcs(dict_bucket, zstd_dict_path("latest"), dictionary)
+        print(f"Published zstd dictionary {dict_id} ({len(dictionary)} bytes)")
+        return dict_id
+
+    def addon_vocabulary_sql(self, min_count):
+        if self.ADDON_FIELDS is not None and "name" not in self.ADDON_FIELDS:
+            name = "NULL"
+        else:
+            name = "APPROX_TOP_COUNT(addon.name, 1)[OFFSET(0)].value"
+        return f"""
+        select
+            addon.addon_id as guid,
+            {name} as name,
+            count(*) as installs
+        from
+            `{self.GCP_PROJECT}`.{self.BIGQUERY_DATASET_ID}.{self.BIGQUERY_TABLE_ID},
+            unnest(active_addons) as addon
+        where
+            addon.addon_id is not null
+        group by
+            guid
+        having
+            installs >= {min_count}
+        order by
+            installs desc, guid
+        """
+
+    def build_addon_vocabulary(
+            self, min_count=10, vocabulary_bucket=ADDON_VOCABULARY_BUCKET
+    ):
+        """
+        Build the vocabulary of the addons installed at least `min_count`
+        times in the BigQuery temporary table, most frequent first, and
+        publish it next to the AMO dumps as the latest vocabulary, under
+        the date and under its vocabulary id.  Payloads only carry the
+        id, so decoders of older rows fetch their vocabulary by id.
+        Returns the vocabulary id.
+        """
+        import bz2
+        import json
+        from taar_etl.taar_profile_codec import addon_vocabulary
+        from taar_etl.taar_utils import store_bytes_to_gcs, store_json_to_gcs
+
+        rows = self.run_query(self.addon_vocabulary_sql(min_count))
+        vocabulary = addon_vocabulary([row["guid"], row["name"]] for row in rows)
+        # Published by id first: rows written with the vocabulary must
+        # never exist before it can be found by id
+        store_bytes_to_gcs(
+            vocabulary_bucket,
+            addon_vocabulary_path(vocabulary["id"]),
+            bz2.compress(json.dumps(vocabulary).encode("utf8")),
+        )
+        store_json_to_gcs(
+            vocabulary_bucket,
+            ADDON_VOCABULARY_PREFIX,
+            ADDON_VOCABULARY_FNAME,
+            vocabulary,
+            self.ISODATE_NODASH,
+        )
+        print(
+            f"Published addon vocabulary {vocabulary['id']} "
+            f"({len(vocabulary['addons'])} addons)"
+        )
+        return vocabulary["id"]
+
+    def payload_codec_options(
+            self,
+            payload_codec,
+            zstd_dict_id="latest",
+            dict_bucket=ZSTD_DICT_BUCKET,
+            addon_vocabulary_version="latest",
+            vocabulary_bucket=ADDON_VOCABULARY_BUCKET,
+    ):
+        """Constructor options of the codec used to write payloads."""
+        from taar_etl.taar_utils import read_bytes_from_gcs, read_from_gcs
+
+        if payload_codec == "zstd-dict":
+            dictionary = read_bytes_from_gcs(dict_bucket, zstd_dict_path(zstd_dict_id))
+            return {"dictionary": dictionary}
+        if payload_codec == "msgpack-addon-ids":
+            fname = ADDON_VOCABULARY_FNAME
+            if addon_vocabulary_version != "latest":
+                fname += f".{addon_vocabulary_version}"
+            vocabulary = read_from_gcs(fname, ADDON_VOCABULARY_PREFIX, vocabulary_bucket)
+            return {"vocabulary": vocabulary}
+        return {}
+
+    def load_bigtable(
+            self,
+            max_num_workers=1,
+            dataflow_service_account=None,
+            payload_codec=DEFAULT_CODEC,
+            zstd_dict_id="latest",
+            delta=False,
+            refresh_days=30,
+            fingerprint_bucket=FINGERPRINT_BUCKET,
+            row_key_index=False,
+            index_bucket=ROW_KEY_INDEX_BUCKET,
+            index_bits=DEFAULT_INDEX_BITS,
+            expected_rows=None,
+            sort_mutations=False,
+            sort_buffer_size=DEFAULT_SORT_BUFFER_SIZE,
+            metrics_output=None,
+            source="avro",
+            read_streams=None,
+            stream_reader=None,
+            resumable=False,
+            mutations_per_second=None,
+            bytes_per_second=None,
+            opt_out_days=None,
+            addon_vocabulary_version="latest",
+    ):
+        """
+        Write the Avro export into BigTable.  The metrics of the job are
+        published to `metrics_output` once it finishes.
+
+        With `source` set to `bigquery-storage` the BigQuery temporary
+        table is read directly over up to `read_streams` parallel
+        Storage Read API streams (4 per worker by default), and the
+        Avro export is not needed.  `stream_reader` replaces the
+        `BigQueryStorageReader` of the table, e.g. with a
+        `FakeStreamReader`.
+
+        A new table is pre-split for `expected_rows` rows.  With
+        `sort_mutations` set, rows are sorted by key in chunks of
+        `sort_buffer_size` within each bundle, so each batch of mutations
+        only touches a few tablets.
+
+        With `row_key_index` set a Bloom filter of every row key in the
+        export is published for `delete_opt_out`.
+
+        With `delta` set only profiles whose fingerprint differs from the
+        previous run's manifest are written.  Every profile is still
+        rewritten once per `refresh_days` (spread evenly over the days
+        by row key) so that cells never reach the 90 day GC age.
+
+        With `resumable` set the load is delegated to
+        `load_bigtable_shards`, which skips shards a previous attempt
+        already wrote.
+
+        `mutations_per_second` and `bytes_per_second` cap the write rate
+        of the whole job, so it can run while TAAR serves from the table.
+
+        With `opt_out_days` set, the profiles of clients which sent a
+        deletion request in the last `opt_out_days` days are dropped
+        before any row is created, instead of being written and then
+        deleted by `delete_opt_out`.
+        """
+        import datetime
         import apache_beam as beam
-        from apache_beam.io.gcp.bigtableio import WriteToBigTable
+        from taar_etl.taar_profile_transforms import CreateBigTableRowsFn, SortRowsByKeyFn
+        from taar_etl.taar_utils import store_bytes_to_gcs
+
+        if resumable:
+            if delta or source != "avro" or opt_out_days:
+                raise ValueError(
+                    "Resumable loads only support full loads of the Avro export "
+                    "without dropping opted-out clients"
+                )
+            return self.load_bigtable_shards(
+                max_num_workers,
+                dataflow_service_account,
+                payload_codec=payload_codec,
+                zstd_dict_id=zstd_dict_id,
+                row_key_index=row_key_index,
+                index_bucket=index_bucket,
+                index_bits=index_bits,
+                expected_rows=expected_rows,
+                sort_mutations=sort_mutations,
+                metrics_output=metrics_output,
+                mutations_per_second=mutations_per_second,
+                bytes_per_second=bytes_per_second,
+                addon_vocabulary_version=addon_vocabulary_version,
+            )
 
-        self.create_table_in_bigtable()
+        self.create_table_in_bigtable(expected_rows)
 
         options = get_dataflow_options(
             max_num_workers,
@@ -175,57 +872,592 @@ class ProfileDataExtraction:
             f"""taar-profile-load-{self.ISODATE_NODASH}""",
             self.GCS_BUCKET,
             self.SUBNETWORK,
-            dataflow_service_account
+            dataflow_service_account,
+            single_sdk_process=bool(mutations_per_second or bytes_per_second),
+        )
+
+        codec_options = self.payload_codec_options(
+            payload_codec, zstd_dict_id, addon_vocabulary_version=addon_vocabulary_version
+        )
+
+        # Every cell written by this job carries the same timestamp
+        timestamp = datetime.datetime.utcnow()
+        # A change of payload encoding must rewrite every profile
+        salt = codec_salt(payload_codec, codec_options)
+        day_index = datetime.datetime.strptime(
+            self.ISODATE_NODASH, "%Y%m%d"
+        ).toordinal()
+
+        previous_manifest = None
+        if delta:
+            previous_manifest = previous_fingerprint_manifest(
+                fingerprint_bucket, self.ISODATE_NODASH
+            )
+            print(f"Previous fingerprint manifest: {previous_manifest}")
+
+        p = beam.Pipeline(options=options)
+        records = self.read_profiles(
+            p, source, read_streams or 4 * max_num_workers, stream_reader
+        )
+        if opt_out_days:
+            records = self.drop_opted_out(p, records, opt_out_days)
+
+        if row_key_index:
+            self.add_row_key_index(records, index_bits, index_bucket)
+
+        if delta:
+            keyed = records | "Fingerprint profiles" >> beam.Map(
+                key_profile_fingerprint, salt
+            )
+            keyed | "Format fingerprints" >> beam.Map(
+                format_fingerprint
+            ) | "Write fingerprint manifest" >> beam.io.WriteToText(
+                f"gs://{fingerprint_bucket}/"
+                f"{fingerprint_manifest_prefix(self.ISODATE_NODASH)}fingerprints",
+                file_name_suffix=".tsv",
+            )
+
+            previous = self.read_previous_fingerprints(p, previous_manifest)
+            joined = {"current": keyed, "previous": previous} | (
+                "Join fingerprints" >> beam.CoGroupByKey()
+            )
+            records = joined | "Select changed profiles" >> beam.FlatMap(
+                select_changed_profiles, refresh_days, day_index
+            )
+
+        rows = records | "Create BigTable Rows" >> beam.ParDo(
+            CreateBigTableRowsFn(timestamp, payload_codec, codec_options)
+        )
+        if sort_mutations:
+            rows = rows | "Sort rows by key" >> beam.ParDo(
+                SortRowsByKeyFn(sort_buffer_size)
+            )
+        rows | "Write Records to Cloud BigTable" >> self.bigtable_writer(
+            max_num_workers, mutations_per_second, bytes_per_second
         )
-        with beam.Pipeline(options=options) as p:
-            p | "Read" >> beam.io.ReadFromAvro(
+
+        result = p.run()
+        result.wait_until_finish()
+        summary = self.publish_metrics(result, "load", metrics_output)
+        rows_failed = summary["counters"].get("rows_failed", 0)
+        if rows_failed:
+            raise RuntimeError(f"{rows_failed} profiles could not be encoded and were not written")
+
+        if delta:
+            # Only a manifest whose rows all reached BigTable may be used
+            # as the baseline of the next delta load
+            store_bytes_to_gcs(
+                fingerprint_bucket,
+                f"{fingerprint_manifest_prefix(self.ISODATE_NODASH)}_SUCCESS",
+                b"",
+            )
+        print("Export to BigTable is complete")
+
+    def read_profiles(self, p, source="avro", read_streams=4, stream_reader=None):
+        """
+        Add the read of the profiles to pipeline `p`, from the Avro
+        export or from the BigQuery temporary table.
+        """
+        import apache_beam as beam
+
+        if source == "bigquery-storage":
+            from taar_etl.taar_profile_bq_read import BigQueryStorageReader
+
+            reader = stream_reader or BigQueryStorageReader(
+                self.GCP_PROJECT, self.BIGQUERY_DATASET_ID, self.BIGQUERY_TABLE_ID
+            )
+            streams = reader.create_streams(read_streams)
+            print(f"Reading {self.BIGQUERY_TABLE_ID} over {len(streams)} read streams")
+            return p | "Read streams" >> beam.Create(
+                streams
+            ) | "Distribute streams" >> beam.Reshuffle() | "Read from BigQuery Storage" >> beam.FlatMap(
+                read_stream_records, reader
+            )
+        if source == "avro":
+            return p | "Read" >> beam.io.ReadFromAvro(
                 gcs_avro_uri(self.GCS_BUCKET, self.ISODATE_NODASH),
                 use_fastavro=True,
-            ) | "Create BigTable Rows" >> beam.Map(
-                create_bigtable_rows
-            ) | "Write Records to Cloud BigTable" >> WriteToBigTable(
-                project_id=self.GCP_PROJECT,
-                instance_id=self.BIGTABLE_INSTANCE_ID,
-                table_id=self.BIGTABLE_TABLE_ID,
             )
-        print("Export to BigTable is complete")
+        raise ValueError(f"Unknown load source {source}")
 
-    def delete_opt_out(self, days, max_num_workers=1, dataflow_service_account=None):
+    def read_previous_fingerprints(self, p, previous_manifest):
+        """The (row key, fingerprint) pairs of the previous delta load, if any."""
         import apache_beam as beam
-        from apache_beam.io.gcp.bigtableio import WriteToBigTable
 
-        sql = f"""
-        select distinct client_id
+        if previous_manifest:
+            return p | "Read previous fingerprints" >> beam.io.ReadFromText(
+                previous_manifest
+            ) | "Parse fingerprints" >> beam.Map(parse_fingerprint)
+        return p | "No previous fingerprints" >> beam.Create([])
+
+    def add_row_key_index(self, records, index_bits, index_bucket):
+        """Publish a Bloom filter of the row keys of `records`."""
+        import apache_beam as beam
+        from taar_etl.taar_profile_transforms import BuildRowKeyIndexFn
+
+        records | "Row keys" >> beam.Map(
+            profile_row_key
+        ) | "Build row key index" >> beam.CombineGlobally(
+            BuildRowKeyIndexFn(index_bits)
+        ) | "Write row key index" >> beam.Map(
+            write_row_key_index,
+            f"gs://{index_bucket}/{row_key_index_path(self.ISODATE_NODASH)}",
+        )
+
+    def opted_out_sql(self, days):
+        """Client ids which sent a deletion request in the last `days` days."""
+        return f"""
+        select distinct {self.client_id_sql()}
         from `moz-fx-data-shared-prod.telemetry.deletion_request`
         where date(submission_timestamp) >= DATE_SUB(DATE '{self.ISODATE_DASH}', INTERVAL {days} DAY)
               and date(submission_timestamp) <= '{self.ISODATE_DASH}'
         """
 
+    def drop_opted_out(self, p, records, days):
+        """
+        Anti-join `records` with the deletion requests of the last `days`
+        days on the hashed client_id.
+        """
+        import apache_beam as beam
+
+        requests = p | "Read deletion requests" >> beam.io.ReadFromBigQuery(
+            query=self.opted_out_sql(days),
+            use_standard_sql=True
+        ) | "Key deletion requests" >> beam.Map(key_by_row_key)
+        keyed = records | "Key profiles" >> beam.Map(key_by_row_key)
+        return {"profiles": keyed, "opted_out": requests} | (
+            "Join deletion requests" >> beam.CoGroupByKey()
+        ) | "Drop opted-out profiles" >> beam.FlatMap(drop_opted_out_profiles)
+
+    def load_bigtable_shards(
+            self,
+            max_num_workers=1,
+            dataflow_service_account=None,
+            payload_codec=DEFAULT_CODEC,
+            zstd_dict_id="latest",
+            row_key_index=False,
+            index_bucket=ROW_KEY_INDEX_BUCKET,
+            index_bits=DEFAULT_INDEX_BITS,
+            expected_rows=None,
+            sort_mutations=False,
+            batch_size=500,
+            max_inflight=4,
+            metrics_output=None,
+            mutations_per_second=None,
+            bytes_per_second=None,
+            addon_vocabulary_version="latest",
+    ):
+        """
+        Resumable variant of `load_bigtable`.  Dataflow workers write
+        whole Avro shards and every shard written in full is recorded in
+        the `ShardManifest` of the date, so a rerun after a failure only
+        loads the shards which were not finished.
+        """
+        import datetime
+        import apache_beam as beam
+        from taar_etl.taar_profile_bulk_load import ShardManifest
+        from taar_etl.taar_profile_transforms import LoadShardFn
+        from taar_etl.taar_utils import store_bytes_to_gcs
+
+        self.create_table_in_bigtable(expected_rows)
+
+        manifest = ShardManifest(self.GCS_BUCKET, self.ISODATE_NODASH)
+        shards = [
+            (f"gs://{self.GCS_BUCKET}/{name}", md5)
+            for name, md5 in list_avro_shard_checksums(self.GCS_BUCKET, self.ISODATE_NODASH)
+        ]
+        pending = manifest.pending(shards)
+        print(f"{len(shards) - len(pending)} of {len(shards)} Avro shards already loaded")
+
+        if pending:
+            options = get_dataflow_options(
+                max_num_workers,
+                self.GCP_PROJECT,
+                f"""taar-profile-load-{self.ISODATE_NODASH}""",
+                self.GCS_BUCKET,
+                self.SUBNETWORK,
+                dataflow_service_account,
+                single_sdk_process=bool(mutations_per_second or bytes_per_second),
+            )
+            load_args = (
+                self.GCP_PROJECT,
+                self.BIGTABLE_INSTANCE_ID,
+                self.BIGTABLE_TABLE_ID,
+                datetime.datetime.utcnow(),
+                payload_codec,
+                self.payload_codec_options(
+                    payload_codec, zstd_dict_id, addon_vocabulary_version=addon_vocabulary_version
+                ),
+                batch_size,
+                max_inflight,
+                index_bits if row_key_index else None,
+                sort_mutations,
+                (
+                    mutations_per_second / max_num_workers if mutations_per_second else None,
+                    bytes_per_second / max_num_workers if bytes_per_second else None,
+                ),
+            )
+
+            p = beam.Pipeline(options=options)
+            p | "Pending shards" >> beam.Create(
+                pending
+            ) | "Distribute shards" >> beam.Reshuffle() | "Load shards" >> beam.ParDo(
+                LoadShardFn(manifest, load_args)
+            )
+            result = p.run()
+            result.wait_until_finish()
+            self.publish_metrics(result, "load", metrics_output)
+
+        if row_key_index:
+            # Shards loaded by earlier attempts contribute their own index
+            index = manifest.merged_row_key_index()
+            if index is not None:
+                store_bytes_to_gcs(
+                    index_bucket, row_key_index_path(self.ISODATE_NODASH), index.to_bytes()
+                )
+        print("Export to BigTable is complete")
+
+    def load_bigtable_local(
+            self,
+            processes=4,
+            batch_size=500,
+            max_inflight=4,
+            payload_codec=DEFAULT_CODEC,
+            zstd_dict_id="latest",
+            local_avro_glob=None,
+            row_key_index=False,
+            index_bucket=ROW_KEY_INDEX_BUCKET,
+            index_bits=DEFAULT_INDEX_BITS,
+            expected_rows=None,
+            sort_mutations=False,
+            resumable=False,
+            mutations_per_second=None,
+            bytes_per_second=None,
+            addon_vocabulary_version="latest",
+            opt_out_days=None,
+            delta=False,
+            source="avro",
+    ):
+        """
+        Write the Avro export into BigTable from this process and a local
+        process pool instead of a Dataflow job.  Cheaper than
+        `load_bigtable` for small sample rates where the Dataflow startup
+        dominates.  `local_avro_glob` reads Avro files from local disk
+        instead of GCS.  With `sort_mutations` set every MutateRows batch
+        is sorted by row key.  With `resumable` set, shards recorded in
+        the `ShardManifest` of the date are skipped.
+
+        With `opt_out_days` set, the profiles of clients which sent a
+        deletion request in the last `opt_out_days` days are not written,
+        as in `load_bigtable`.  Delta loads and the bigquery-storage
+        source need Dataflow.
+        """
+        import datetime
+        from taar_etl.taar_profile_bulk_load import ShardManifest, bulk_load, file_md5
+        from taar_etl.taar_utils import store_bytes_to_gcs
+
+        if delta or source != "avro":
+            raise click.UsageError(
+                "The local load only supports full loads of the Avro export, "
+                "without --delta-load or --load-source=bigquery-storage"
+            )
+
+        skip_row_keys = None
+        if opt_out_days:
+            skip_row_keys = frozenset(
+                profile_row_key(row) for row in self.run_query(self.opted_out_sql(opt_out_days))
+            )
+            print(f"Dropping the profiles of {len(skip_row_keys)} opted-out clients")
+
+        self.create_table_in_bigtable(expected_rows)
+
+        shards = self.avro_shard_uris(local_avro_glob)
+
+        manifest = None
+        checksums = {}
+        if resumable:
+            manifest = ShardManifest(self.GCS_BUCKET, self.ISODATE_NODASH)
+            if local_avro_glob:
+                checksums = {shard: file_md5(shard) for shard in shards}
+            else:
+                checksums = {
+                    f"gs://{self.GCS_BUCKET}/{name}": md5
+                    for name, md5 in list_avro_shard_checksums(
+                        self.GCS_BUCKET, self.ISODATE_NODASH
+                    )
+                }
+            pending = manifest.pending([(shard, checksums.get(shard)) for shard in shards])
+            print(f"{len(shards) - len(pending)} of {len(shards)} Avro shards already loaded")
+            shards = [shard for shard, _ in pending]
+
+        def on_shard_loaded(result):
+            if manifest is not None:
+                manifest.mark_loaded(result["shard"], checksums.get(result["shard"]), result)
+
+        print(f"Bulk loading {len(shards)} Avro shards")
+
+        summary = bulk_load(
+            shards,
+            self.GCP_PROJECT,
+            self.BIGTABLE_INSTANCE_ID,
+            self.BIGTABLE_TABLE_ID,
+            datetime.datetime.utcnow(),
+            payload_codec,
+            self.payload_codec_options(
+                payload_codec, zstd_dict_id, addon_vocabulary_version=addon_vocabulary_version
+            ),
+            processes=processes,
+            batch_size=batch_size,
+            max_inflight=max_inflight,
+            index_bits=index_bits if row_key_index else None,
+            sort_batches=sort_mutations,
+            on_shard_loaded=on_shard_loaded,
+            mutations_per_second=mutations_per_second,
+            bytes_per_second=bytes_per_second,
+            skip_row_keys=skip_row_keys,
+        )
+        index = summary["row_key_index"]
+        if manifest is not None and row_key_index:
+            # Shards loaded by earlier attempts contribute their own index
+            index = manifest.merged_row_key_index()
+        if index is not None:
+            store_bytes_to_gcs(
+                index_bucket,
+                row_key_index_path(self.ISODATE_NODASH),
+                index.to_bytes(),
+            )
+        return summary
+
+    def avro_shard_uris(self, local_avro_glob=None):
+        """
+        The Avro shards of the date as gs:// URIs, or the local files
+        matching `local_avro_glob` if it is set.
+        """
+        import glob
+
+        if local_avro_glob:
+            return sorted(glob.glob(local_avro_glob))
+        return [
+            f"gs://{self.GCS_BUCKET}/{name}"
+            for name in list_avro_shards(self.GCS_BUCKET, self.ISODATE_NODASH)
+        ]
+
+    def verify_bigtable(
+            self,
+            samples=1000,
+            concurrency=16,
+            payload_codec=DEFAULT_CODEC,
+            zstd_dict_id="latest",
+            local_avro_glob=None,
+            max_errors=0,
+            metrics_output=None,
+            seed=None,
+            addon_vocabulary_version="latest",
+            opt_out_days=None,
+    ):
+        """
+        Read back `samples` profiles of the Avro export from BigTable
+        and check that they decode to the profiles which were loaded.
+        The report, with read latency percentiles, is written to
+        `<metrics_output>/verify.json`.
+
+        With `opt_out_days` set, clients which sent a deletion request
+        in the last `opt_out_days` days are left out of the sample: the
+        load or `delete_opt_out` may have removed their rows.
+
+        :raises RuntimeError: more than `max_errors` sampled rows are
+                              missing, undecodable or mismatched.
+        """
+        import json
+        from google.cloud import bigtable
+        from taar_etl.taar_profile_codec import get_codec, register_decoder
+        from taar_etl.taar_profile_verify import sample_records, verify_profiles
+
+        # Codecs such as zstd-dict need their dictionary to decode
+        codec_options = self.payload_codec_options(
+            payload_codec, zstd_dict_id, addon_vocabulary_version=addon_vocabulary_version
+        )
+        if payload_codec == "msgpack-addon-ids":
+            # Rows written before the vocabulary was rebuilt carry the id
+            # of an older one
+            codec_options["vocabulary_loader"] = read_addon_vocabulary
+        register_decoder(get_codec(payload_codec, **codec_options))
+
+        records = sample_records(self.avro_shard_uris(local_avro_glob), samples, seed=seed)
+        opted_out = 0
+        if opt_out_days:
+            requested = {profile_row_key(row) for row in self.run_query(self.opted_out_sql(opt_out_days))}
+            kept = [record for record in records if profile_row_key(record) not in requested]
+            opted_out = len(records) - len(kept)
+            records = kept
+        print(f"Verifying {len(records)} profiles in BigTable, {opted_out} opted-out profiles skipped")
+
+        client = bigtable.Client(project=self.GCP_PROJECT)
+        table = client.instance(self.BIGTABLE_INSTANCE_ID).table(self.BIGTABLE_TABLE_ID)
+        report = verify_profiles(table, records, concurrency)
+        report.update(
+            {"iso_date": self.ISODATE_NODASH, "payload_codec": payload_codec, "opted_out": opted_out}
+        )
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+        output = metrics_output or default_metrics_output(self.ISODATE_NODASH)
+        uri = write_metrics_summary(report, f"{output.rstrip('/')}/verify.json")
+        print(f"Wrote verification report to {uri}")
+
+        errors = report["missing"] + report["undecodable"] + report["mismatched"]
+        if errors > max_errors:
+            raise RuntimeError(
+                f"{errors} of {report['sampled']} sampled profiles failed verification"
+            )
+        return report
+
+    def export_parquet(self, output_prefix=None, batch_size=10000, local_avro_glob=None):
+        """
+        Write the Avro export as flattened Parquet files for model
+        training and analytics.  `output_prefix` is a local directory or
+        a gs:// URI and defaults to
+        gs://<PARQUET_BUCKET>/<PARQUET_PREFIX>/<iso-date>.
+        """
+        from taar_etl.taar_profile_parquet import export_parquet
+
+        if output_prefix is None:
+            output_prefix = f"gs://{PARQUET_BUCKET}/{PARQUET_PREFIX}/{self.ISODATE_NODASH}"
+        shards = self.avro_shard_uris(local_avro_glob)
+        return export_parquet(shards, output_prefix, batch_size)
+
+    def deletion_requests_sql(self, days, watermark, incremental):
+        """
+        The query of the hashed client ids of the deletion requests up to
+        the end of the run date, and that end as an ISO 8601 timestamp.
+        With `incremental` set only the requests newer than `watermark`
+        (less `OPT_OUT_WATERMARK_LAG_DAYS`) are read, otherwise those of
+        the last `days` days as well.
+        """
+        from datetime import datetime, time, timedelta, timezone
+
+        upper = datetime.combine(
+            datetime.strptime(self.ISODATE_NODASH, "%Y%m%d") + timedelta(days=1), time(),
+            tzinfo=timezone.utc,
+        ).isoformat(timespec="microseconds")
+        since = []
+        if not incremental:
+            since.append(
+                f"date(submission_timestamp) >= DATE_SUB(DATE '{self.ISODATE_DASH}', INTERVAL {days} DAY)"
+            )
+        if watermark is not None:
+            since.append(
+                f"submission_timestamp > TIMESTAMP_SUB("
+                f"TIMESTAMP '{watermark}', INTERVAL {OPT_OUT_WATERMARK_LAG_DAYS} DAY)"
+            )
+        sql = f"""
+        select distinct {self.client_id_sql()}
+        from `moz-fx-data-shared-prod.telemetry.deletion_request`
+        where ({" or ".join(since)})
+              and submission_timestamp < TIMESTAMP '{upper}'
+        """
+        return sql, upper
+
+    def delete_opt_out(
+            self,
+            days,
+            max_num_workers=1,
+            dataflow_service_account=None,
+            filter_by_index=False,
+            index_bucket=ROW_KEY_INDEX_BUCKET,
+            full_sweep=False,
+            watermark_bucket=OPT_OUT_WATERMARK_BUCKET,
+            metrics_output=None,
+            mutations_per_second=None,
+            bytes_per_second=None,
+            load_opt_out_days=None,
+    ):
+        """
+        Delete the profiles of clients which sent a deletion request.
+        The metrics of the job are published to `metrics_output`, and
+        deletes are sent within the `mutations_per_second` and
+        `bytes_per_second` budget, if set.
+
+        clients_last_seen keeps a client for up to 28 days after their
+        last ping, so a daily load may write an opted-out client back.
+        Unless the loads drop the clients of the last `load_opt_out_days`
+        days themselves, with `load_opt_out_days` at least `days`, every
+        request of the last `days` days is therefore applied again on
+        each run, which costs as much as the whole window every day.
+        Requests older than the window but newer than the stored
+        high-watermark are processed as well, which catches up after an
+        outage longer than the window.
+
+        When the loads do drop them only the requests newer than the
+        watermark, less `OPT_OUT_WATERMARK_LAG_DAYS` for late rows, are
+        read and deleted.  The watermark is advanced to the end of the
+        run date once the deletes are written.  With `full_sweep` set
+        the watermark is ignored and the whole window is applied.
+
+        With `filter_by_index` set, deletion requests are first checked
+        against the row key indexes published by the loads which may
+        still have rows in the table, and only keys which may be in the
+        table are deleted.  If any day of that window has no index every
+        requested client is deleted.
+        """
+        import apache_beam as beam
+        from taar_etl.taar_profile_index import load_row_key_indexes
+        from taar_etl.taar_profile_transforms import FilterByRowKeyIndexFn
+
+        watermark = None if full_sweep else read_opt_out_watermark(watermark_bucket)
+        print(f"Opt-out watermark: {watermark}")
+        incremental = (
+            watermark is not None and load_opt_out_days is not None and load_opt_out_days >= days
+        )
+        if not incremental:
+            print(f"Applying every deletion request of the last {days} days again")
+        sql, upper = self.deletion_requests_sql(days, watermark, incremental)
+
+        index = None
+        if filter_by_index:
+            index = load_row_key_indexes(
+                self.ISODATE_NODASH, ROW_KEY_INDEX_DAYS, index_bucket
+            )
+            if index is None:
+                print("Incomplete row key indexes, deleting every requested client")
+
         options = get_dataflow_options(
             max_num_workers,
             self.GCP_PROJECT,
             f"""taar-profile-delete-{self.ISODATE_NODASH}""",
             self.GCS_BUCKET,
             self.SUBNETWORK,
-            dataflow_service_account
+            dataflow_service_account,
+            single_sdk_process=bool(mutations_per_second or bytes_per_second),
         )
 
-        with beam.Pipeline(options=options) as p:
-            p | "Read from BigQuery" >> beam.io.ReadFromBigQuery(
-                query=sql,
-                use_standard_sql=True
-            ) | "Collect rows" >> beam.Map(
-                delete_bigtable_rows
-            ) | "Delete in Cloud BigTable" >> WriteToBigTable(
-                project_id=self.GCP_PROJECT,
-                instance_id=self.BIGTABLE_INSTANCE_ID,
-                table_id=self.BIGTABLE_TABLE_ID,
+        p = beam.Pipeline(options=options)
+        requests = p | "Read from BigQuery" >> beam.io.ReadFromBigQuery(
+            query=sql,
+            use_standard_sql=True
+        )
+        if index is not None:
+            requests = requests | "Filter by row key index" >> beam.ParDo(
+                FilterByRowKeyIndexFn(index.to_bytes())
             )
+        requests | "Collect rows" >> beam.Map(
+            delete_bigtable_rows
+        ) | "Delete in Cloud BigTable" >> self.bigtable_writer(
+            max_num_workers, mutations_per_second, bytes_per_second
+        )
+
+        result = p.run()
+        result.wait_until_finish()
+        self.publish_metrics(result, "delete-opt-out", metrics_output)
+
+        # A full sweep of an older date must not move the watermark back
+        if watermark is None or upper > watermark:
+            store_opt_out_watermark(watermark_bucket, upper, self.ISODATE_NODASH)
+            print(f"Advanced opt-out watermark to {upper}")
 
 
 # Cloud Dataflow functions below
 def explode_active_addons(jdata):
-    import hashlib
+    from taar_etl.taar_profile_codec import profile_row_key
 
     obj = {}
     for k in [
@@ -244,9 +1476,7 @@ def explode_active_addons(jdata):
         obj[k] = int(jdata[k] or 0)
 
     obj["subsession_length"] = int(jdata["subsession_length"] or 0)
-    obj["client_id"] = hashlib.sha256(
-        jdata["client_id"].encode("utf8")
-    ).hexdigest()
+    obj["client_id"] = profile_row_key(jdata)
 
     # Now fix the addons
 
@@ -267,26 +1497,28 @@ def explode_active_addons(jdata):
     obj["addon_is_web_extension"] = []
     obj["addon_multiprocess_compatible"] = []
 
+    # Addon fields left out of the active_addons projection take
+    # their default value
     for rec in jdata["active_addons"]:
-        obj["addon_addon_id"].append(rec["addon_id"])
-        obj["addon_blocklisted"].append(rec["blocklisted"] or False)
-        obj["addon_name"].append(rec["name"] or "")
-        obj["addon_user_disabled"].append(rec["user_disabled"] or False)
-        obj["addon_app_disabled"].append(rec["app_disabled"] or False)
-        obj["addon_version"].append(rec["version"] or "")
-        obj["addon_scope"].append(int(rec["scope"] or 0))
-        obj["addon_type"].append(rec["type"] or "")
-        obj["addon_foreign_install"].append(rec["foreign_install"] or False)
+        obj["addon_addon_id"].append(rec.get("addon_id"))
+        obj["addon_blocklisted"].append(rec.get("blocklisted") or False)
+        obj["addon_name"].append(rec.get("name") or "")
+        obj["addon_user_disabled"].append(rec.get("user_disabled") or False)
+        obj["addon_app_disabled"].append(rec.get("app_disabled") or False)
+        obj["addon_version"].append(rec.get("version") or "")
+        obj["addon_scope"].append(int(rec.get("scope") or 0))
+        obj["addon_type"].append(rec.get("type") or "")
+        obj["addon_foreign_install"].append(rec.get("foreign_install") or False)
         obj["addon_has_binary_components"].append(
-            rec["has_binary_components"] or False
+            rec.get("has_binary_components") or False
         )
-        obj["addon_install_day"].append(int(rec["install_day"] or 0))
-        obj["addon_update_day"].append(int(rec["update_day"] or 0))
-        obj["addon_signed_state"].append(int(rec["signed_state"] or 0))
-        obj["addon_is_system"].append(rec["is_system"] or False)
-        obj["addon_is_web_extension"].append(rec["is_web_extension"] or False)
+        obj["addon_install_day"].append(int(rec.get("install_day") or 0))
+        obj["addon_update_day"].append(int(rec.get("update_day") or 0))
+        obj["addon_signed_state"].append(int(rec.get("signed_state") or 0))
+        obj["addon_is_system"].append(rec.get("is_system") or False)
+        obj["addon_is_web_extension"].append(rec.get("is_web_extension") or False)
         obj["addon_multiprocess_compatible"].append(
-            rec["multiprocess_compatible"] or False
+            rec.get("multiprocess_compatible") or False
         )
 
     return obj
@@ -329,23 +1561,113 @@ def create_bigtable_rows(jdata):
     return direct_row
 
 
+def read_stream_records(stream, reader):
+    """Records of one read stream of a `StreamReader`."""
+    return reader.read_stream(stream)
+
+
+def write_row_key_index(index_bytes, uri):
+    from apache_beam.io.filesystems import FileSystems
+
+    with FileSystems.create(uri) as fout:
+        fout.write(index_bytes)
+    return uri
+
+
+def key_by_row_key(element):
+    from taar_etl.taar_profile_codec import profile_row_key
+
+    return profile_row_key(element), element
+
+
+def drop_opted_out_profiles(joined):
+    """
+    Yield the profiles of a CoGroupByKey of profiles and deletion
+    requests whose client did not ask for deletion.
+    """
+    from apache_beam.metrics import Metrics
+
+    _, groups = joined
+    profiles = list(groups["profiles"])
+    if list(groups["opted_out"]):
+        Metrics.counter(METRICS_NAMESPACE, "profiles_opted_out").inc(len(profiles))
+        return
+    for element in profiles:
+        yield element
+
+
+def key_profile_fingerprint(element, salt):
+    """
+    Key an Avro record by its row key with a stable fingerprint of its
+    content.  `salt` identifies the payload encoding.
+    """
+    import hashlib
+    import json
+    from taar_etl.taar_profile_codec import profile_row_key
+
+    row_key = profile_row_key(element)
+    content = json.dumps(element, sort_keys=True, default=str)
+    fingerprint = hashlib.sha1(
+        (salt + content).encode("utf8")
+    ).hexdigest()[:16]
+    return row_key, (fingerprint, element)
+
+
+def format_fingerprint(keyed):
+    row_key, (fingerprint, _) = keyed
+    return f"{row_key}\t{fingerprint}"
+
+
+def parse_fingerprint(line):
+    row_key, fingerprint = line.split("\t")
+    return row_key, fingerprint
+
+
+def select_changed_profiles(joined, refresh_days, day_index):
+    """
+    Yield the records of a CoGroupByKey of current and previous
+    fingerprints which are new, changed or due for their periodic
+    refresh.
+    """
+    from apache_beam.metrics import Metrics
+
+    row_key, groups = joined
+    previous = set(groups["previous"])
+    refresh = bool(refresh_days) and (
+        int(row_key[:8], 16) % refresh_days == day_index % refresh_days
+    )
+    for fingerprint, element in groups["current"]:
+        if fingerprint not in previous:
+            yield element
+        elif refresh:
+            Metrics.counter(METRICS_NAMESPACE, "profiles_refreshed").inc()
+            yield element
+        else:
+            Metrics.counter(METRICS_NAMESPACE, "profiles_unchanged").inc()
+
+
 def delete_bigtable_rows(element):
+    from apache_beam.metrics import Metrics
     from google.cloud.bigtable import row
-    import hashlib
+    from taar_etl.taar_profile_codec import profile_row_key
 
-    row_key = hashlib.sha256(element['client_id'].encode("utf8")).hexdigest()
+    row_key = profile_row_key(element)
     direct_row = row.DirectRow(row_key=row_key)
     direct_row.delete()
+    Metrics.counter(METRICS_NAMESPACE, "deletions_issued").inc()
     return direct_row
 
 
 def get_dataflow_options(
         max_num_workers, gcp_project, job_name, gcs_bucket, subnetwork,
-        service_account
+        service_account, single_sdk_process=False
 ):
+    import os
     from apache_beam.options.pipeline_options import (
+        DebugOptions,
         GoogleCloudOptions,
         PipelineOptions,
+        SetupOptions,
         StandardOptions,
         WorkerOptions,
     )
@@ -375,14 +1697,85 @@ def get_dataflow_options(
     if service_account:
         options.view_as(GoogleCloudOptions).service_account_email = service_account
 
+    # Ship this package to the workers so that DoFns can import
+    # shared modules such as taar_etl.taar_profile_codec
+    setup_file = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "setup.py"
+    )
+    if os.path.exists(setup_file):
+        options.view_as(SetupOptions).setup_file = setup_file
+
+    # Dataflow runs one SDK process per vCPU by default.  Throttled
+    # writes share their budget per process, so pin a single process
+    # per worker to make each worker's share of the budget hold.
+    if single_sdk_process:
+        options.view_as(DebugOptions).add_experiment("no_use_multiple_sdk_containers")
+
     return options
 
 
+def resolve_dates(iso_date, date_range):
+    """
+    The start and end dates of a run, from `--iso-date` or from a
+    `--date-range` of the form START:END.  The start is None for a
+    single date.
+    """
+    from datetime import datetime
+
+    if not date_range:
+        if not iso_date:
+            raise click.UsageError("One of --iso-date or --date-range is required")
+        return None, iso_date
+    try:
+        start_date, end_date = date_range.split(":")
+        for value in (start_date, end_date):
+            datetime.strptime(value, "%Y%m%d")
+    except ValueError:
+        raise click.BadParameter("Expected START:END as YYYYMMDD:YYYYMMDD", param_hint="--date-range")
+    if start_date > end_date:
+        raise click.BadParameter(f"{start_date} is after {end_date}", param_hint="--date-range")
+    if iso_date and iso_date != end_date:
+        raise click.BadParameter(
+            "--iso-date must be the end of --date-range when both are given", param_hint="--iso-date"
+        )
+    return start_date, end_date
+
+
+def validate_sample_salt(ctx, param, value):
+    import re
+
+    if not re.fullmatch(SAMPLE_SALT_PATTERN, value):
+        raise click.BadParameter(f"Only letters, digits, _ and - are allowed, got {value!r}")
+    return value
+
+
+def parse_addon_fields(ctx, param, value):
+    """The comma separated --addon-fields as a list, or None."""
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(",")]
+    unknown = [field for field in fields if field not in ACTIVE_ADDON_FIELDS]
+    if unknown:
+        raise click.BadParameter(
+            f"Unknown active_addons fields {', '.join(unknown)}. "
+            f"Expected some of {', '.join(ACTIVE_ADDON_FIELDS)}"
+        )
+    if "addon_id" not in fields:
+        raise click.BadParameter("addon_id must be one of the fields")
+    return fields
+
+
 @click.command()
 @click.option(
     "--iso-date",
-    required=True,
-    help="Date as YYYYMMDD. Used to specify timestamps for avro files in GCS.",
+    help="Date as YYYYMMDD. Used to specify timestamps for avro files in GCS. "
+         "Required unless --date-range is given.",
+)
+@click.option(
+    "--date-range",
+    help="Backfill the dates START:END (YYYYMMDD:YYYYMMDD) in one run: the latest profile "
+         "of each client seen in the range is exported in one BigQuery job and loaded by "
+         "one Dataflow pipeline. Files, markers and manifests are tagged with END.",
 )
 @click.option(
     "--gcp-project", type=str, required=True, help="GCP Project to run in",
@@ -428,6 +1821,21 @@ def get_dataflow_options(
     help="Sampling rate (0 to 1.0) of clients to pull from clients_last_seen",
     default=0.0001,
 )
+@click.option(
+    "--sampling",
+    type=click.Choice(SAMPLING_MODES),
+    default="random",
+    help="random draws a new sample of clients every day. deterministic buckets "
+         "clients with FARM_FINGERPRINT so the same clients stay in the sample "
+         "day to day, which delta loads depend on.",
+)
+@click.option(
+    "--sample-salt",
+    default="",
+    callback=validate_sample_salt,
+    help="Salt of the deterministic sampling buckets, made of letters, digits, _ and -. "
+         "Change it to rotate the sample.",
+)
 @click.option(
     "--subnetwork",
     help="GCE subnetwork for launching workers. Default is up to the "
@@ -436,12 +1844,35 @@ def get_dataflow_options(
     "subnetwork name. For more information, see "
     "https://cloud.google.com/compute/docs/vpc/"
 )
+@click.option(
+    "--hash-in-bigquery/--hash-in-dataflow",
+    default=False,
+    help="Hash client_ids and cast numeric columns in the BigQuery extract "
+         "and deletion queries instead of on the Dataflow workers.",
+)
+@click.option(
+    "--addon-fields",
+    callback=parse_addon_fields,
+    help="Comma separated fields of the active_addons structs to export, e.g. "
+         "addon_id,name,is_system. All fields are exported by default.",
+)
+@click.option(
+    "--drop-system-addons",
+    is_flag=True,
+    default=False,
+    help="Leave system addons out of the exported active_addons.",
+)
+@click.option(
+    "--drop-disabled-addons",
+    is_flag=True,
+    default=False,
+    help="Leave user or app disabled addons out of the exported active_addons.",
+)
 @click.option(
     "--fill-bq",
     "stage",
     help="Populate a bigquery table to prepare for Avro export on GCS",
     flag_value="fill-bq",
-    required=True,
     default=True,
 )
 @click.option(
@@ -449,36 +1880,276 @@ def get_dataflow_options(
     "stage",
     help="Export BigQuery table to Avro files on GCS",
     flag_value="bq-to-gcs",
-    required=True,
 )
 @click.option(
     "--gcs-to-bigtable",
     "stage",
     help="Import Avro files into BigTable",
     flag_value="gcs-to-bigtable",
-    required=True,
+)
+@click.option(
+    "--gcs-to-bigtable-local",
+    "stage",
+    help="Import Avro files into BigTable from a local process pool instead of Dataflow",
+    flag_value="gcs-to-bigtable-local",
+)
+@click.option(
+    "--verify-bigtable",
+    "stage",
+    help="Read back a sample of the Avro profiles from BigTable and check their payloads",
+    flag_value="verify-bigtable",
+)
+@click.option(
+    "--gcs-to-parquet",
+    "stage",
+    help="Export Avro files as flattened Parquet files",
+    flag_value="gcs-to-parquet",
 )
 @click.option(
     "--wipe-bigquery-tmp-table",
     "stage",
     help="Remove temporary table from BigQuery",
     flag_value="wipe-bigquery-tmp-table",
-    required=True,
 )
 @click.option(
     "--bigtable-delete-opt-out",
     "stage",
     help="Delete data from Bigtable for users that sent telemetry deletion requests in the last N days.",
     flag_value="bigtable-delete-opt-out",
-    required=True,
+)
+@click.option(
+    "--train-zstd-dict",
+    "stage",
+    help="Train a zstd dictionary on the Avro files on GCS and publish it for the zstd-dict payload codec",
+    flag_value="train-zstd-dict",
+)
+@click.option(
+    "--build-addon-vocabulary",
+    "stage",
+    help="Build the addon vocabulary of the BigQuery temporary table and publish it "
+         "next to the AMO dumps for the msgpack-addon-ids payload codec",
+    flag_value="build-addon-vocabulary",
+)
+@click.option(
+    "--all",
+    "stage",
+    help="Run fill-bq, bq-to-gcs, gcs-to-bigtable and wipe-bigquery-tmp-table in order, "
+         "skipping stages already completed for this date.",
+    flag_value="all",
+)
+@click.option(
+    "--stages",
+    help="Comma separated stages to run in order, e.g. fill-bq,bq-to-gcs,gcs-to-bigtable. "
+         "Stages already completed for this date with the same inputs are skipped.",
 )
 @click.option(
     "--delete-opt-out-days",
-    help="The number of days to analyze telemetry deletion requests for.",
+    help="The number of days of telemetry deletion requests applied again on every run, "
+         "as the daily load may write opted-out clients back.  Only the requests newer than "
+         "the stored watermark are applied when --load-drop-opted-out-days covers this window.",
     default=28,
 )
+@click.option(
+    "--opt-out-full-sweep",
+    is_flag=True,
+    default=False,
+    help="Ignore the stored watermark and only process the deletion requests "
+         "of the last --delete-opt-out-days days.",
+)
+@click.option(
+    "--load-drop-opted-out-days",
+    type=int,
+    help="Drop the profiles of clients which sent a deletion request in the last N days "
+         "from --gcs-to-bigtable and --gcs-to-bigtable-local, before any row is written. "
+         "Not available with --resumable-load on Dataflow.",
+)
+@click.option(
+    "--opt-out-watermark-gcs-bucket",
+    default=OPT_OUT_WATERMARK_BUCKET,
+    help="GCS bucket holding the high-watermark of processed deletion requests.",
+)
+@click.option(
+    "--payload-codec",
+    type=click.Choice(sorted(CODECS)),
+    default=DEFAULT_CODEC,
+    help="Encoding of the profile:payload cell written to BigTable. "
+         "The TAAR profile fetcher must be able to decode it.",
+)
+@click.option(
+    "--write-mutations-per-second",
+    type=float,
+    help="Budget of BigTable mutations per second of the import and deletion stages, "
+         "split evenly across Dataflow workers or bulk load processes. Unlimited by default.",
+)
+@click.option(
+    "--write-bytes-per-second",
+    type=float,
+    help="Budget of BigTable mutation bytes per second of the import and deletion stages, "
+         "split evenly across Dataflow workers or bulk load processes. Unlimited by default.",
+)
+@click.option(
+    "--resumable-load/--no-resumable-load",
+    default=False,
+    help="Record every Avro shard written to BigTable in a manifest and skip "
+         "shards already written when the load is run again for the same date. "
+         "Not available with --delta-load or --load-source=bigquery-storage.",
+)
+@click.option(
+    "--load-source",
+    type=click.Choice(LOAD_SOURCES),
+    default="avro",
+    help="Read profiles for --gcs-to-bigtable from the Avro export on GCS, or "
+         "straight from the BigQuery temporary table with the Storage Read API, "
+         "which makes --bq-to-gcs unnecessary.",
+)
+@click.option(
+    "--read-streams",
+    type=int,
+    help="Maximum number of Storage Read API streams with --load-source=bigquery-storage. "
+         "Defaults to 4 per Dataflow worker.",
+)
+@click.option(
+    "--delta-load/--full-load",
+    default=False,
+    help="Only write profiles which changed since the previous load "
+         "(as recorded in its fingerprint manifest).",
+)
+@click.option(
+    "--delta-refresh-days",
+    type=int,
+    default=30,
+    help="In delta loads, rewrite every profile at least once in this many "
+         "days. Must stay below the 90 day GC age of the profile column family.",
+)
+@click.option(
+    "--fingerprint-gcs-bucket",
+    default=FINGERPRINT_BUCKET,
+    help="GCS bucket holding the fingerprint manifests used by delta loads.",
+)
+@click.option(
+    "--bulk-load-processes",
+    type=int,
+    default=4,
+    help="Number of processes used by --gcs-to-bigtable-local.",
+)
+@click.option(
+    "--bulk-load-batch-size",
+    type=int,
+    default=500,
+    help="Rows per MutateRows call in --gcs-to-bigtable-local.",
+)
+@click.option(
+    "--bulk-load-max-inflight",
+    type=int,
+    default=4,
+    help="Maximum number of outstanding MutateRows calls per process in --gcs-to-bigtable-local.",
+)
+@click.option(
+    "--local-avro-glob",
+    help="Read Avro files matching this local path glob in --gcs-to-bigtable-local, "
+         "--verify-bigtable and --gcs-to-parquet instead of GCS.",
+)
+@click.option(
+    "--verify-samples",
+    type=int,
+    default=1000,
+    help="Number of profiles read back by --verify-bigtable.",
+)
+@click.option(
+    "--verify-concurrency",
+    type=int,
+    default=16,
+    help="Number of concurrent BigTable reads of --verify-bigtable.",
+)
+@click.option(
+    "--verify-max-errors",
+    type=int,
+    default=0,
+    help="Number of missing, undecodable or mismatched profiles tolerated by --verify-bigtable.",
+)
+@click.option(
+    "--parquet-output",
+    help="Local directory or gs:// prefix for --gcs-to-parquet. "
+         "Defaults to gs://taar_models/taar/profile/parquet/<iso-date>",
+)
+@click.option(
+    "--parquet-batch-size",
+    type=int,
+    default=10000,
+    help="Profiles per Parquet row group in --gcs-to-parquet.",
+)
+@click.option(
+    "--row-key-index/--no-row-key-index",
+    default=False,
+    help="Publish a Bloom filter of loaded row keys when importing into BigTable.",
+)
+@click.option(
+    "--opt-out-filter-by-index/--no-opt-out-filter-by-index",
+    default=False,
+    help="Only delete opt-out clients found in the row key indexes of the loads which may "
+         "still have rows in the table. Every client is deleted if any day lacks an index.",
+)
+@click.option(
+    "--row-key-index-gcs-bucket",
+    default=ROW_KEY_INDEX_BUCKET,
+    help="GCS bucket holding the row key indexes.",
+)
+@click.option(
+    "--bigtable-expected-rows",
+    type=int,
+    help="Number of profiles used to pre-split a newly created BigTable table. "
+         "Defaults to the row count of the BigQuery temporary table.",
+)
+@click.option(
+    "--sort-mutations/--no-sort-mutations",
+    default=False,
+    help="Sort rows by key before writing them to BigTable, in chunks of "
+         "--sort-buffer-size rows, so each batch of mutations hits few tablets.",
+)
+@click.option(
+    "--sort-buffer-size",
+    type=int,
+    default=DEFAULT_SORT_BUFFER_SIZE,
+    help="Rows sorted together by --sort-mutations in --gcs-to-bigtable.",
+)
+@click.option(
+    "--metrics-output",
+    help="Local directory or gs:// prefix receiving a JSON summary of the Beam "
+         "metrics of --gcs-to-bigtable and --bigtable-delete-opt-out. "
+         "Defaults to gs://taar_models/taar/profile/metrics/<iso-date>",
+)
+@click.option(
+    "--zstd-dict-id",
+    default="latest",
+    help="Id of the trained dictionary used by the zstd-dict payload codec.",
+)
+@click.option(
+    "--zstd-dict-samples",
+    type=int,
+    default=20000,
+    help="Number of profiles used to train the zstd dictionary.",
+)
+@click.option(
+    "--zstd-dict-size",
+    type=int,
+    default=100 * 1024,
+    help="Size in bytes of the trained zstd dictionary.",
+)
+@click.option(
+    "--addon-vocabulary-version",
+    default="latest",
+    help="Date (YYYYMMDD) of the addon vocabulary used by the msgpack-addon-ids "
+         "payload codec, or latest.",
+)
+@click.option(
+    "--addon-vocabulary-min-count",
+    type=int,
+    default=10,
+    help="Minimum number of installs of an addon in the addon vocabulary.",
+)
 def main(
         iso_date,
+        date_range,
         gcp_project,
         bigquery_dataset_id,
         bigquery_table_id,
@@ -488,15 +2159,57 @@ def main(
         dataflow_workers,
         dataflow_service_account,
         sample_rate,
+        sampling,
+        sample_salt,
         subnetwork,
+        hash_in_bigquery,
+        addon_fields,
+        drop_system_addons,
+        drop_disabled_addons,
         stage,
-        delete_opt_out_days
+        stages,
+        delete_opt_out_days,
+        opt_out_full_sweep,
+        load_drop_opted_out_days,
+        opt_out_watermark_gcs_bucket,
+        payload_codec,
+        zstd_dict_id,
+        zstd_dict_samples,
+        zstd_dict_size,
+        delta_load,
+        delta_refresh_days,
+        fingerprint_gcs_bucket,
+        bulk_load_processes,
+        bulk_load_batch_size,
+        bulk_load_max_inflight,
+        local_avro_glob,
+        row_key_index,
+        opt_out_filter_by_index,
+        row_key_index_gcs_bucket,
+        parquet_output,
+        parquet_batch_size,
+        bigtable_expected_rows,
+        sort_mutations,
+        sort_buffer_size,
+        metrics_output,
+        load_source,
+        read_streams,
+        resumable_load,
+        write_mutations_per_second,
+        write_bytes_per_second,
+        verify_samples,
+        verify_concurrency,
+        verify_max_errors,
+        addon_vocabulary_version,
+        addon_vocabulary_min_count,
 ):
+    start_date, iso_date = resolve_dates(iso_date, date_range)
     print(
         f"""
 ===
 Running job with :
     SAMPLE RATE             : {sample_rate}
+    SAMPLING                : {sampling}
     DATAFLOW_WORKERS        : {dataflow_workers}
     DATAFLOW_SERVICE_ACCOUNT: {dataflow_service_account}
     GCP_PROJECT             : {gcp_project}
@@ -506,9 +2219,27 @@ Running job with :
     BIGTABLE_INSTANCE_ID    : {bigtable_instance_id}
     BIGTABLE_TABLE_ID       : {bigtable_table_id}
     ISODATE_NODASH          : {iso_date}
+    START_DATE              : {start_date}
     SUBNETWORK              : {subnetwork}
-    STAGE                   : {stage}
-    DELETE_OPT_OUT_DAYS      : {delete_opt_out_days}
+    HASH_IN_BIGQUERY        : {hash_in_bigquery}
+    ADDON_FIELDS            : {addon_fields}
+    DROP_SYSTEM_ADDONS      : {drop_system_addons}
+    DROP_DISABLED_ADDONS    : {drop_disabled_addons}
+    STAGE                   : {stages or stage}
+    DELETE_OPT_OUT_DAYS     : {delete_opt_out_days}
+    OPT_OUT_FULL_SWEEP      : {opt_out_full_sweep}
+    LOAD_DROP_OPTED_OUT_DAYS: {load_drop_opted_out_days}
+    LOAD_SOURCE             : {load_source}
+    PAYLOAD_CODEC           : {payload_codec}
+    ZSTD_DICT_ID            : {zstd_dict_id}
+    ADDON_VOCABULARY        : {addon_vocabulary_version}
+    DELTA_LOAD              : {delta_load}
+    RESUMABLE_LOAD          : {resumable_load}
+    WRITE_MUTATIONS_PER_SEC : {write_mutations_per_second}
+    WRITE_BYTES_PER_SEC     : {write_bytes_per_second}
+    ROW_KEY_INDEX           : {row_key_index}
+    OPT_OUT_FILTER_BY_INDEX : {opt_out_filter_by_index}
+    SORT_MUTATIONS          : {sort_mutations}
 ===
 """
     )
@@ -522,28 +2253,151 @@ Running job with :
         bigtable_table_id,
         sample_rate,
         subnetwork,
+        hash_in_bigquery,
+        addon_fields,
+        drop_system_addons,
+        drop_disabled_addons,
+        sampling,
+        sample_salt,
+        start_date,
     )
 
-    if stage == "fill-bq":
-        print("Starting BigQuery export")
-        extractor.extract()
-        print("BQ export complete")
-    elif stage == "bq-to-gcs":
-        print("Avro export starting")
-        extractor.dump_avro()
-        print("Avro dump completed")
-    elif stage == "gcs-to-bigtable":
-        print("BigTable import starting")
-        extractor.load_bigtable(dataflow_workers, dataflow_service_account)
-        print("BigTable import completed")
-    elif stage == "wipe-bigquery-tmp-table":
-        print("Clearing temporary BigQuery table: ")
-        extractor.wipe_bigquery_tmp_table()
-        print("BigTable clearing completed")
-    elif stage == "bigtable-delete-opt-out":
-        print("Deleting opt-out users from Bigtable")
-        extractor.delete_opt_out(delete_opt_out_days, dataflow_workers, dataflow_service_account)
-        print("BigTable opt-out users deletion completed")
+    from taar_etl.taar_profile_stages import PIPELINE_STAGES, StageOrchestrator
+
+    # Rows of opted-out clients are dropped by the load or deleted by
+    # bigtable-delete-opt-out, so verification skips either window.
+    # Local Avro files are loaded as they are.
+    verify_opt_out_days = None
+    if not local_avro_glob:
+        verify_opt_out_days = max(load_drop_opted_out_days or 0, delete_opt_out_days)
+
+    # Options which change what a stage writes, recorded in the
+    # completion markers of multi-stage runs
+    load_config = {
+        "payload_codec": payload_codec,
+        "zstd_dict_id": zstd_dict_id,
+        "addon_vocabulary_version": addon_vocabulary_version,
+        "delta": delta_load,
+        "refresh_days": delta_refresh_days,
+        "fingerprint_bucket": fingerprint_gcs_bucket,
+        "row_key_index": row_key_index,
+        "index_bucket": row_key_index_gcs_bucket,
+        "source": load_source,
+        "opt_out_days": load_drop_opted_out_days,
+    }
+    stage_configs = {
+        "gcs-to-bigtable": load_config,
+        "gcs-to-bigtable-local": load_config,
+        "gcs-to-parquet": {"output": parquet_output},
+        "verify-bigtable": {
+            "samples": verify_samples,
+            "payload_codec": payload_codec,
+            "addon_vocabulary_version": addon_vocabulary_version,
+            "max_errors": verify_max_errors,
+            "opt_out_days": verify_opt_out_days,
+        },
+        "train-zstd-dict": {"samples": zstd_dict_samples, "size": zstd_dict_size},
+        "build-addon-vocabulary": {"min_count": addon_vocabulary_min_count},
+        "bigtable-delete-opt-out": {
+            "days": delete_opt_out_days,
+            "full_sweep": opt_out_full_sweep,
+            "filter_by_index": opt_out_filter_by_index,
+            "load_opt_out_days": load_drop_opted_out_days,
+        },
+    }
+
+    stage_actions = {
+        "fill-bq": extractor.extract,
+        "bq-to-gcs": extractor.dump_avro,
+        "gcs-to-bigtable": lambda: extractor.load_bigtable(
+            dataflow_workers,
+            dataflow_service_account,
+            expected_rows=bigtable_expected_rows,
+            sort_mutations=sort_mutations,
+            sort_buffer_size=sort_buffer_size,
+            metrics_output=metrics_output,
+            read_streams=read_streams,
+            resumable=resumable_load,
+            mutations_per_second=write_mutations_per_second,
+            bytes_per_second=write_bytes_per_second,
+            **load_config,
+        ),
+        "gcs-to-bigtable-local": lambda: extractor.load_bigtable_local(
+            bulk_load_processes,
+            bulk_load_batch_size,
+            bulk_load_max_inflight,
+            payload_codec=payload_codec,
+            zstd_dict_id=zstd_dict_id,
+            local_avro_glob=local_avro_glob,
+            row_key_index=row_key_index,
+            index_bucket=row_key_index_gcs_bucket,
+            expected_rows=bigtable_expected_rows,
+            sort_mutations=sort_mutations,
+            resumable=resumable_load,
+            mutations_per_second=write_mutations_per_second,
+            bytes_per_second=write_bytes_per_second,
+            addon_vocabulary_version=addon_vocabulary_version,
+            opt_out_days=load_drop_opted_out_days,
+            delta=delta_load,
+            source=load_source,
+        ),
+        "verify-bigtable": lambda: extractor.verify_bigtable(
+            verify_samples,
+            verify_concurrency,
+            payload_codec=payload_codec,
+            zstd_dict_id=zstd_dict_id,
+            local_avro_glob=local_avro_glob,
+            max_errors=verify_max_errors,
+            metrics_output=metrics_output,
+            addon_vocabulary_version=addon_vocabulary_version,
+            opt_out_days=verify_opt_out_days,
+        ),
+        "gcs-to-parquet": lambda: extractor.export_parquet(
+            parquet_output, parquet_batch_size, local_avro_glob
+        ),
+        "train-zstd-dict": lambda: extractor.train_zstd_dictionary(
+            zstd_dict_samples, zstd_dict_size
+        ),
+        "build-addon-vocabulary": lambda: extractor.build_addon_vocabulary(
+            addon_vocabulary_min_count
+        ),
+        "wipe-bigquery-tmp-table": extractor.wipe_bigquery_tmp_table,
+        "bigtable-delete-opt-out": lambda: extractor.delete_opt_out(
+            delete_opt_out_days,
+            dataflow_workers,
+            dataflow_service_account,
+            filter_by_index=opt_out_filter_by_index,
+            index_bucket=row_key_index_gcs_bucket,
+            full_sweep=opt_out_full_sweep,
+            watermark_bucket=opt_out_watermark_gcs_bucket,
+            metrics_output=metrics_output,
+            mutations_per_second=write_mutations_per_second,
+            bytes_per_second=write_bytes_per_second,
+            load_opt_out_days=load_drop_opted_out_days,
+        ),
+    }
+
+    if stages:
+        stage_list = [name.strip() for name in stages.split(",")]
+    elif stage == "all":
+        stage_list = list(PIPELINE_STAGES)
+        if load_source == "bigquery-storage":
+            # The load reads the BigQuery table itself
+            stage_list.remove("bq-to-gcs")
+    else:
+        stage_list = None
+
+    if stage_list:
+        unknown = [name for name in stage_list if name not in stage_actions]
+        if unknown:
+            raise click.BadParameter(
+                f"Unknown stages {', '.join(unknown)}", param_hint="--stages"
+            )
+        StageOrchestrator(extractor).run(stage_list, stage_actions, stage_configs)
+    else:
+        print(f"Running stage {stage}")
+        stage_actions[stage]()
+        print(f"Stage {stage} completed")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+"""
+Read the temporary profile table straight from BigQuery with the
+BigQuery Storage Read API, instead of exporting it to Avro on GCS and
+reading the Avro files back.
+
+A `StreamReader` splits a table into read streams and yields the
+records of one stream as dictionaries, identical to the records of the
+Avro export.  The Dataflow load creates the streams when the pipeline
+is built and reads them in parallel on the workers.
+`FakeStreamReader` serves in-memory records through the same
+interface, so the read path can run without BigQuery.
+"""
+
+import io
+import json
+
+
+class StreamReader:
+    """
+    Base class of read stream sources.  `create_streams` is called once
+    when the pipeline is built, then the reader is pickled to the
+    workers which call `read_stream` on each stream name.
+    """
+
+    def create_streams(self, max_streams):
+        """Return the names of at most `max_streams` read streams."""
+        raise NotImplementedError
+
+    def read_stream(self, stream):
+        """Yield the records of the read stream named `stream`."""
+        raise NotImplementedError
+
+
+class BigQueryStorageReader(StreamReader):
+    """
+    Read a BigQuery table through a Storage Read API session using the
+    Avro data format.  Rows are decoded with fastavro, like the Avro
+    export, so records are the same dictionaries either way.
+    """
+
+    def __init__(self, project, dataset_id, table_id, selected_fields=None):
+        self._project = project
+        self._table = f"projects/{project}/datasets/{dataset_id}/tables/{table_id}"
+        self._selected_fields = list(selected_fields or [])
+        self._schema = None
+        self._client = None
+
+    def __getstate__(self):
+        # gRPC clients cannot be pickled, workers open their own
+        state = dict(self.__dict__)
+        state["_client"] = None
+        return state
+
+    def _read_client(self):
+        if self._client is None:
+            from google.cloud import bigquery_storage_v1
+
+            self._client = bigquery_storage_v1.BigQueryReadClient()
+        return self._client
+
+    def create_streams(self, max_streams):
+        read_session = {"table": self._table, "data_format": "AVRO"}
+        if self._selected_fields:
+            read_session["read_options"] = {"selected_fields": self._selected_fields}
+        session = self._read_client().create_read_session(
+            parent=f"projects/{self._project}",
+            read_session=read_session,
+            max_stream_count=max_streams,
+        )
+        self._schema = session.avro_schema.schema
+        return [stream.name for stream in session.streams]
+
+    def read_stream(self, stream):
+        import fastavro
+
+        if self._schema is None:
+            raise RuntimeError("create_streams must be called before read_stream")
+        schema = fastavro.parse_schema(json.loads(self._schema))
+        for response in self._read_client().read_rows(stream):
+            data = response.avro_rows.serialized_binary_rows
+            block = io.BytesIO(data)
+            while block.tell() < len(data):
+                yield fastavro.schemaless_reader(block, schema)
+
+
+class FakeStreamReader(StreamReader):
+    """
+    Serve `records` from memory, dealt round-robin across the streams.
+    """
+
+    def __init__(self, records):
+        self._records = list(records)
+
+    def create_streams(self, max_streams):
+        count = max(1, min(max_streams, len(self._records)))
+        return [f"fake/{index}/{count}" for index in range(count)]
+
+    def read_stream(self, stream):
+        _, index, count = stream.split("/")
+        return iter(self._records[int(index)::int(count)])
@@ -0,0 +1,330 @@
+"""
+Load the Avro export of taar_profile_bigtable into Cloud BigTable
+without Dataflow.
+
+Avro shards are spread across a pool of processes.  Each process
+builds rows with `CreateBigTableRowsFn` and writes them with batched
+MutateRows calls, keeping at most `max_inflight` batches outstanding.
+
+Shards are either `gs://<bucket>/<name>` URIs or local file paths, and
+the BigTable client honours BIGTABLE_EMULATOR_HOST, so this can run
+entirely against local files and the BigTable emulator.
+
+Resumable loads record every shard written in full in a
+`ShardManifest`, and a rerun only loads the shards missing from it.
+Rewriting a shard is harmless: the new cells replace the old ones.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+LOAD_MANIFEST_PREFIX = "taar-profile-load-manifest"
+
+
+def file_md5(path):
+    """Base64 MD5 of a local file, in the format GCS reports for blobs."""
+    import base64
+    import hashlib
+
+    digest = hashlib.md5()
+    with open(path, "rb") as fin:
+        for chunk in iter(lambda: fin.read(1 << 20), b""):
+            digest.update(chunk)
+    return base64.b64encode(digest.digest()).decode("ascii")
+
+
+class ShardManifest:
+    """
+    The shards of one day's load already written to BigTable.
+
+    Each completed shard is recorded as its own small JSON object (and
+    the Bloom filter of its row keys, if one was built) under
+    gs://<bucket>/taar-profile-load-manifest.<YYYYMMDD>/, so that
+    workers finishing shards at the same time never update the same
+    object.  An entry only matches a shard with the same MD5: a shard
+    exported again is loaded again.
+    """
+
+    def __init__(self, bucket, iso_date):
+        self.bucket = bucket
+        self.iso_date = iso_date
+
+    @property
+    def prefix(self):
+        return f"{LOAD_MANIFEST_PREFIX}.{self.iso_date}/"
+
+    def entry_path(self, shard):
+        return f"{self.prefix}{os.path.basename(shard)}.json"
+
+    def index_path(self, shard):
+        return f"{self.prefix}{os.path.basename(shard)}.bloom"
+
+    def completed(self):
+        """Map the name of every loaded shard to its MD5."""
+        from google.cloud import storage
+
+        client = storage.Client()
+        done = {}
+        for blob in client.list_blobs(self.bucket, prefix=self.prefix):
+            if blob.name.endswith(".json"):
+                entry = json.loads(blob.download_as_string())
+                done[entry["shard"]] = entry["md5"]
+        return done
+
+    def pending(self, shards):
+        """The `(shard, md5)` pairs of `shards` not loaded yet."""
+        done = self.completed()
+        return [
+            (shard, md5) for shard, md5 in shards
+            if done.get(os.path.basename(shard)) != md5
+        ]
+
+    def mark_loaded(self, shard, md5, result):
+        """Record `shard` as loaded, with its `load_shard` result."""
+        from taar_etl.taar_utils import store_bytes_to_gcs
+
+        # The index goes first: an entry is only written once everything
+        # it stands for is stored
+        if result.get("row_key_index") is not None:
+            store_bytes_to_gcs(self.bucket, self.index_path(shard), result["row_key_index"])
+        entry = {
+            "shard": os.path.basename(shard),
+            "md5": md5,
+            "rows": result["rows"],
+            "seconds": result["seconds"],
+        }
+        store_bytes_to_gcs(self.bucket, self.entry_path(shard), json.dumps(entry).encode("utf8"))
+
+    def merged_row_key_index(self):
+        """
+        Merge the row key indexes of every loaded shard, or return None
+        if no shard has one.
+        """
+        from google.cloud import storage
+        from taar_etl.taar_profile_index import RowKeyBloomFilter
+
+        client = storage.Client()
+        merged = None
+        for blob in client.list_blobs(self.bucket, prefix=self.prefix):
+            if blob.name.endswith(".bloom"):
+                index = RowKeyBloomFilter.from_bytes(blob.download_as_string())
+                merged = index if merged is None else merged.update(index)
+        return merged
+
+
+def iter_shard_records(shard):
+    """Yield the records of an Avro shard in GCS or on local disk."""
+    if shard.startswith("gs://"):
+        from taar_etl.taar_profile_bigtable import read_avro_shard
+
+        bucket, _, blob_name = shard[len("gs://"):].partition("/")
+        for record in read_avro_shard(bucket, blob_name):
+            yield record
+    else:
+        import fastavro
+
+        with open(shard, "rb") as fin:
+            for record in fastavro.reader(fin):
+                yield record
+
+
+def shard_rows(shard, row_builder, skip_row_keys, counts):
+    """
+    Yield the DirectRows `row_builder` builds from the records of
+    `shard`.  Records whose row key is in `skip_row_keys` are counted in
+    `counts["skipped"]`, malformed records the builder drops in
+    `counts["unencodable"]`.
+    """
+    from taar_etl.taar_profile_codec import profile_row_key
+
+    for record in iter_shard_records(shard):
+        if skip_row_keys and profile_row_key(record) in skip_row_keys:
+            counts["skipped"] += 1
+            continue
+        built = list(row_builder.process(record))
+        if not built:
+            counts["unencodable"] += 1
+        for direct_row in built:
+            yield direct_row
+
+
+def load_shard(
+        shard,
+        project,
+        instance_id,
+        table_id,
+        timestamp,
+        payload_codec,
+        codec_options,
+        batch_size,
+        max_inflight,
+        index_bits=None,
+        sort_batches=False,
+        write_budget=None,
+        skip_row_keys=None,
+):
+    """
+    Write every record of one shard to BigTable.  Runs in a pool
+    process, so it sets up its own BigTable client.  With `sort_batches`
+    set each batch is sorted by row key before it is written.
+    `write_budget` is a `(mutations_per_second, bytes_per_second)` pair
+    shared by every shard loaded in this process.  Records whose row key
+    is in `skip_row_keys`, such as opted-out clients, are not written.
+
+    Returns a dictionary with the shard name, the number of rows written,
+    failed (including records which could not be encoded) and skipped, the elapsed seconds and, if `index_bits` is set,
+    the serialized row key index of the shard.
+    """
+    from google.cloud import bigtable
+    from taar_etl.taar_profile_transforms import CreateBigTableRowsFn
+    from taar_etl.taar_profile_index import RowKeyBloomFilter
+    from taar_etl.taar_profile_throttle import mutate_rows_with_backoff, shared_budget
+
+    start = time.perf_counter()
+    budget = shared_budget(*write_budget) if write_budget else None
+
+    client = bigtable.Client(project=project)
+    table = client.instance(instance_id).table(table_id)
+
+    row_builder = CreateBigTableRowsFn(timestamp, payload_codec, codec_options)
+    row_builder.setup()
+
+    inflight = threading.BoundedSemaphore(max_inflight)
+    futures = []
+
+    def write_batch(batch):
+        if sort_batches:
+            batch.sort(key=lambda direct_row: direct_row.row_key)
+        try:
+            failed, _ = mutate_rows_with_backoff(table, batch, budget)
+            return failed
+        finally:
+            inflight.release()
+
+    index = RowKeyBloomFilter(index_bits) if index_bits else None
+
+    rows = 0
+    counts = {"skipped": 0, "unencodable": 0}
+    with ThreadPoolExecutor(max_workers=max_inflight) as executor:
+        batch = []
+        for direct_row in shard_rows(shard, row_builder, skip_row_keys, counts):
+            if index is not None:
+                index.add(direct_row.row_key.decode("utf8"))
+            batch.append(direct_row)
+            if len(batch) >= batch_size:
+                inflight.acquire()
+                futures.append(executor.submit(write_batch, batch))
+                rows += len(batch)
+                batch = []
+        if batch:
+            inflight.acquire()
+            futures.append(executor.submit(write_batch, batch))
+            rows += len(batch)
+
+    failed = sum(future.result() for future in futures)
+    return {
+        "shard": shard,
+        "rows": rows - failed,
+        "failed": failed + counts["unencodable"],
+        "skipped": counts["skipped"],
+        "seconds": time.perf_counter() - start,
+        "row_key_index": index.to_bytes() if index is not None else None,
+    }
+
+
+def bulk_load(
+        shards,
+        project,
+        instance_id,
+        table_id,
+        timestamp,
+        payload_codec,
+        codec_options=None,
+        processes=4,
+        batch_size=500,
+        max_inflight=4,
+        index_bits=None,
+        sort_batches=False,
+        on_shard_loaded=None,
+        mutations_per_second=None,
+        bytes_per_second=None,
+        skip_row_keys=None,
+):
+    """
+    Load `shards` into BigTable across `processes` processes and print
+    the throughput of the run.  If `index_bits` is set the summary holds
+    a `RowKeyBloomFilter` of every row key written.  `on_shard_loaded`
+    is called with the result of every shard written without failures.
+    The `mutations_per_second` and `bytes_per_second` budget of the load
+    is split evenly across the processes.  Records whose row key is in
+    `skip_row_keys` are not written.
+
+    :raises RuntimeError: some rows could not be written.
+    """
+    import multiprocessing
+    from taar_etl.taar_profile_index import RowKeyBloomFilter
+
+    write_budget = None
+    if mutations_per_second or bytes_per_second:
+        write_budget = (
+            mutations_per_second / processes if mutations_per_second else None,
+            bytes_per_second / processes if bytes_per_second else None,
+        )
+
+    start = time.perf_counter()
+    summary = {"shards": 0, "rows": 0, "failed": 0, "skipped": 0, "row_key_index": None}
+
+    # Processes are spawned rather than forked: gRPC channels opened in
+    # the parent do not survive a fork.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+        futures = [
+            pool.submit(
+                load_shard,
+                shard,
+                project,
+                instance_id,
+                table_id,
+                timestamp,
+                payload_codec,
+                codec_options or {},
+                batch_size,
+                max_inflight,
+                index_bits,
+                sort_batches,
+                write_budget,
+                skip_row_keys,
+            )
+            for shard in shards
+        ]
+        for future in futures:
+            result = future.result()
+            print(
+                f"Loaded {result['shard']}: {result['rows']} rows "
+                f"({result['failed']} failed, {result['skipped']} skipped) in {result['seconds']:.1f}s"
+            )
+            summary["shards"] += 1
+            summary["rows"] += result["rows"]
+            summary["failed"] += result["failed"]
+            summary["skipped"] += result["skipped"]
+            if on_shard_loaded is not None and not result["failed"]:
+                on_shard_loaded(result)
+            if result["row_key_index"] is not None:
+                index = RowKeyBloomFilter.from_bytes(result["row_key_index"])
+                if summary["row_key_index"] is None:
+                    summary["row_key_index"] = index
+                else:
+                    summary["row_key_index"].update(index)
+
+    summary["seconds"] = time.perf_counter() - start
+    summary["rows_per_second"] = summary["rows"] / max(summary["seconds"], 1e-9)
+    print(
+        f"Bulk load wrote {summary['rows']} rows from {summary['shards']} shards "
+        f"in {summary['seconds']:.1f}s ({summary['rows_per_second']:.0f} rows/sec)"
+    )
+    if summary["failed"]:
+        raise RuntimeError(f"{summary['failed']} rows failed to write to BigTable")
+    return summary
@@ -0,0 +1,391 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Encoders and decoders for the `profile:payload` cell of the TAAR
+profile table in Cloud BigTable.
+
+Payloads written before codecs were versioned are bare zlib streams of
+the JSON profile.  Versioned payloads start with a single header byte
+holding the codec version.  A zlib stream always starts with 0x78, so
+the header can never be mistaken for a legacy payload and
+`decode_payload` can read every format that has ever been written.
+
+Codecs that need external state to decode (such as a zstd dictionary
+or an addon vocabulary) must be handed to `register_decoder` before
+`decode_payload` can read their payloads.
+
+This module only depends on the standard library (plus msgpack and
+zstandard for the codecs that use them) so that the TAAR profile
+fetcher can import it.
+"""
+
+import json
+import zlib
+
+# First byte of every zlib stream written with the default window size
+ZLIB_HEADER = 0x78
+
+DEFAULT_CODEC = "json-zlib"
+
+# zstd cannot train a dictionary on fewer samples than this
+ZSTD_DICT_MIN_SAMPLES = 10
+
+# Numeric columns of the BigQuery extract that are exported as floats
+INT_COLUMNS = (
+    "bookmark_count",
+    "tab_open_count",
+    "total_uri",
+    "unique_tlds",
+    "subsession_length",
+)
+
+
+# Extracts prepared in BigQuery carry the SHA256 hex digest of the
+# client_id in this column instead of the raw client_id, and numeric
+# columns which are already integers.
+HASHED_CLIENT_ID = "hashed_client_id"
+
+
+def profile_row_key(record):
+    """The BigTable row key of a record: its hashed client_id."""
+    import hashlib
+
+    hashed = record.get(HASHED_CLIENT_ID)
+    if hashed is not None:
+        return hashed
+    return hashlib.sha256(record["client_id"].encode("utf8")).hexdigest()
+
+
+def profile_payload(record):
+    """
+    Build the profile dictionary stored in BigTable from one record of
+    the Avro export: the client_id is replaced by its SHA256 hex digest
+    and float columns are coerced to int.  Records prepared in BigQuery
+    only need `hashed_client_id` renamed.  The record itself is left
+    untouched.
+    """
+    if HASHED_CLIENT_ID in record:
+        jdata = {"client_id": record[HASHED_CLIENT_ID]}
+        jdata.update(item for item in record.items() if item[0] != HASHED_CLIENT_ID)
+        return jdata
+
+    jdata = dict(record)
+    jdata["client_id"] = profile_row_key(record)
+    for k in INT_COLUMNS:
+        jdata[k] = int(jdata[k] or 0)
+    return jdata
+
+
+class PayloadCodec:
+    """
+    Base class of all payload codecs.
+
+    `name` is used on the command line, `version` is the header byte
+    written in front of the payload (None for the legacy format).
+    """
+
+    name = None
+    version = None
+
+    def encode(self, profile):
+        raise NotImplementedError
+
+    def decode(self, payload):
+        raise NotImplementedError
+
+
+class JSONZlibCodec(PayloadCodec):
+    """
+    The original format: zlib compressed JSON without a header byte.
+    """
+
+    name = "json-zlib"
+    version = None
+
+    def __init__(self):
+        self._encode = json.JSONEncoder().encode
+
+    def encode(self, profile):
+        return zlib.compress(self._encode(profile).encode("utf8"))
+
+    def decode(self, payload):
+        return json.loads(zlib.decompress(payload).decode("utf8"))
+
+
+def addons_to_columns(addons):
+    """
+    Convert the `active_addons` list of structs into a field list and
+    one column per field.  Each field name is then stored once per
+    profile instead of once per addon.
+    """
+    if not addons:
+        return {"fields": [], "columns": []}
+    fields = list(addons[0].keys())
+    columns = [[addon.get(field) for addon in addons] for field in fields]
+    return {"fields": fields, "columns": columns}
+
+
+def columns_to_addons(columnar):
+    fields = columnar["fields"]
+    return [dict(zip(fields, values)) for values in zip(*columnar["columns"])]
+
+
+class ZstdDictCodec(PayloadCodec):
+    """
+    Header byte followed by a zstd frame of the JSON profile compressed
+    against a trained dictionary.  The frame header carries the id of
+    the dictionary so a decoder holding several dictionaries picks the
+    right one.
+
+    :param dictionary: raw bytes of the dictionary used to encode.
+    :param dictionaries: additional dictionaries accepted on decode.
+    """
+
+    name = "zstd-dict"
+    version = 2
+
+    def __init__(self, dictionary=None, dictionaries=(), level=3):
+        import zstandard
+
+        self._zstd = zstandard
+        self._json_encode = json.JSONEncoder().encode
+        self._compressor = None
+        self._decompressors = {}
+
+        if dictionary is not None:
+            zdict = zstandard.ZstdCompressionDict(dictionary)
+            self._compressor = zstandard.ZstdCompressor(
+                level=level, dict_data=zdict, write_checksum=False
+            )
+            self.add_dictionary(dictionary)
+        for extra in dictionaries:
+            self.add_dictionary(extra)
+
+    def add_dictionary(self, dictionary):
+        zdict = self._zstd.ZstdCompressionDict(dictionary)
+        self._decompressors[zdict.dict_id()] = self._zstd.ZstdDecompressor(
+            dict_data=zdict
+        )
+
+    def encode(self, profile):
+        if self._compressor is None:
+            raise ValueError("zstd-dict codec needs a dictionary to encode")
+        data = self._json_encode(profile).encode("utf8")
+        return bytes([self.version]) + self._compressor.compress(data)
+
+    def decode(self, payload):
+        frame = payload[1:]
+        dict_id = self._zstd.get_frame_parameters(frame).dict_id
+        decompressor = self._decompressors.get(dict_id)
+        if decompressor is None:
+            raise ValueError(f"No zstd dictionary registered with id {dict_id}")
+        return json.loads(decompressor.decompress(frame).decode("utf8"))
+
+
+def train_zstd_dictionary(profiles, dict_size=100 * 1024):
+    """
+    Train a zstd dictionary on the JSON encoding of `profiles`, the same
+    bytes that `ZstdDictCodec` compresses.  Returns the raw dictionary.
+
+    :raises ValueError: fewer than `ZSTD_DICT_MIN_SAMPLES` profiles.
+    """
+    import zstandard
+
+    encode = json.JSONEncoder().encode
+    samples = [encode(profile).encode("utf8") for profile in profiles]
+    if len(samples) < ZSTD_DICT_MIN_SAMPLES:
+        raise ValueError(
+            f"Training a zstd dictionary needs at least {ZSTD_DICT_MIN_SAMPLES} profiles, got {len(samples)}"
+        )
+    return zstandard.train_dictionary(dict_size, samples).as_bytes()
+
+
+def zstd_dictionary_id(dictionary):
+    import zstandard
+
+    return zstandard.ZstdCompressionDict(dictionary).dict_id()
+
+
+def addon_vocabulary(addons):
+    """
+    Build the addon vocabulary artifact from `[guid, name]` entries,
+    most frequent first.  The position of an entry is the integer id of
+    its GUID, and the vocabulary id is a checksum of the entries.
+    """
+    addons = [list(entry) for entry in addons]
+    vocabulary_id = zlib.crc32(json.dumps(addons).encode("utf8"))
+    return {"id": vocabulary_id, "addons": addons}
+
+
+def count_addon_vocabulary(profiles, min_count=1):
+    """
+    Build the addon vocabulary of `profiles`: GUIDs installed at least
+    `min_count` times sorted by decreasing count, each with its most
+    common name.
+    """
+    from collections import Counter
+
+    counts = Counter()
+    names = {}
+    for profile in profiles:
+        for addon in profile.get("active_addons") or ():
+            guid = addon.get("addon_id")
+            if guid is None:
+                continue
+            counts[guid] += 1
+            names.setdefault(guid, Counter())[addon.get("name")] += 1
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return addon_vocabulary(
+        [guid, names[guid].most_common(1)[0][0]]
+        for guid, count in ranked
+        if count >= min_count
+    )
+
+
+# Stored in the name column in place of a name equal to the vocabulary's
+VOCABULARY_NAME = 0
+
+
+class AddonIdsCodec(PayloadCodec):
+    """
+    Header byte and the 4 byte id of an addon vocabulary, followed by
+    zlib compressed msgpack of the profile with `active_addons` in the
+    layout of `addons_to_columns`.  GUIDs
+    found in the vocabulary are stored as their integer id, and names
+    equal to the vocabulary name of their GUID as `VOCABULARY_NAME`.
+    Other GUIDs and names are kept as strings, so decoded profiles are
+    identical to the JSON format.
+
+    :param vocabulary: the vocabulary used to encode, as built by
+        `addon_vocabulary`.
+    :param vocabularies: additional vocabularies accepted on decode.
+    :param vocabulary_loader: called with the id of a vocabulary missing
+        on decode, e.g. of rows written before the vocabulary was
+        rebuilt, and returns that vocabulary.
+    """
+
+    name = "msgpack-addon-ids"
+    version = 3
+
+    def __init__(self, vocabulary=None, vocabularies=(), vocabulary_loader=None):
+        import msgpack
+
+        self._packer = msgpack.Packer(use_bin_type=True)
+        self._unpackb = msgpack.unpackb
+        self._vocabulary_id = None
+        self._ids = {}
+        self._vocabularies = {}
+        self._vocabulary_loader = vocabulary_loader
+
+        if vocabulary is not None:
+            self._vocabulary_id = vocabulary["id"]
+            self._ids = {guid: index for index, (guid, _) in enumerate(vocabulary["addons"])}
+            self.add_vocabulary(vocabulary)
+        for extra in vocabularies:
+            self.add_vocabulary(extra)
+
+    def add_vocabulary(self, vocabulary):
+        self._vocabularies[vocabulary["id"]] = vocabulary["addons"]
+
+    def encode(self, profile):
+        if self._vocabulary_id is None:
+            raise ValueError("msgpack-addon-ids codec needs a vocabulary to encode")
+        body = dict(profile)
+        columnar = addons_to_columns(body.get("active_addons"))
+        fields = columnar["fields"]
+        if "addon_id" in fields:
+            addons = self._vocabularies[self._vocabulary_id]
+            guids = columnar["columns"][fields.index("addon_id")]
+            names = columnar["columns"][fields.index("name")] if "name" in fields else None
+            for i, guid in enumerate(guids):
+                index = self._ids.get(guid)
+                if index is None:
+                    continue
+                guids[i] = index
+                if names is not None and names[i] == addons[index][1]:
+                    names[i] = VOCABULARY_NAME
+        body["active_addons"] = columnar
+        header = bytes([self.version]) + self._vocabulary_id.to_bytes(4, "big")
+        return header + zlib.compress(self._packer.pack(body))
+
+    def decode(self, payload):
+        vocabulary_id = int.from_bytes(payload[1:5], "big")
+        addons = self._vocabularies.get(vocabulary_id)
+        if addons is None and self._vocabulary_loader is not None:
+            self.add_vocabulary(self._vocabulary_loader(vocabulary_id))
+            addons = self._vocabularies.get(vocabulary_id)
+        if addons is None:
+            raise ValueError(f"No addon vocabulary registered with id {vocabulary_id}")
+        body = self._unpackb(zlib.decompress(payload[5:]), raw=False)
+        columnar = body["active_addons"]
+        fields = columnar["fields"]
+        if "addon_id" in fields:
+            guids = columnar["columns"][fields.index("addon_id")]
+            names = columnar["columns"][fields.index("name")] if "name" in fields else None
+            for i, guid in enumerate(guids):
+                if not isinstance(guid, int):
+                    continue
+                guids[i] = addons[guid][0]
+                if names is not None and names[i] == VOCABULARY_NAME:
+                    names[i] = addons[guid][1]
+        body["active_addons"] = columns_to_addons(columnar)
+        return body
+
+
+# Header byte 1 was used by a msgpack-zlib codec, dropped as it was no
+# smaller than json-zlib.  It must not be reused.
+CODECS = {
+    codec.name: codec
+    for codec in (JSONZlibCodec, ZstdDictCodec, AddonIdsCodec)
+}
+
+
+def get_codec(name, **options):
+    """
+    Instantiate the codec registered under `name`, passing `options` to
+    its constructor.
+
+    :raises ValueError: no codec is registered under that name.
+    """
+    if name not in CODECS:
+        raise ValueError(
+            "Unknown payload codec {}. Expected one of {}".format(
+                name, ", ".join(sorted(CODECS))
+            )
+        )
+    return CODECS[name](**options)
+
+
+_decoders = {}
+
+
+def register_decoder(codec):
+    """
+    Use the `codec` instance to decode payloads of its version.  This is
+    required for codecs which cannot decode without extra state.
+    """
+    _decoders[codec.version] = codec
+
+
+def decode_payload(payload):
+    """
+    Decode a `profile:payload` cell written by any codec into the
+    profile dictionary.
+
+    :raises ValueError: the header byte does not match a known codec.
+    """
+    version = payload[0]
+    if version == ZLIB_HEADER:
+        version = None
+
+    decoder = _decoders.get(version)
+    if decoder is None:
+        for codec in CODECS.values():
+            if codec.version == version:
+                decoder = _decoders[version] = codec()
+                break
+        else:
+            raise ValueError(f"Unknown profile payload version: {version}")
+    return decoder.decode(payload)
@@ -0,0 +1,111 @@
+"""
+Membership index of the row keys loaded into the TAAR profile table.
+
+Every load publishes a Bloom filter of the row keys it wrote.  The
+opt-out deletion stage checks the hashed client_ids of deletion
+requests against the filters of the loads which may still have rows
+in the table, and only issues delete mutations for keys which may
+exist.  A Bloom filter has no false negatives, so no stored profile is
+missed as long as every load of the window published its filter;
+false positives only cost a wasted delete mutation.
+"""
+
+import struct
+
+ROW_KEY_INDEX_BUCKET = "taar_models"
+ROW_KEY_INDEX_PREFIX = "taar/profile/row_key_index"
+
+# The 90 day MaxAge GC rule of the profile column family, plus a week
+# as BigTable garbage collection is asynchronous: older loads cannot
+# have rows left in the table.
+ROW_KEY_INDEX_DAYS = 90 + 7
+
+# 2 MiB filter: about 1% false positives at 1.75 million keys
+DEFAULT_INDEX_BITS = 1 << 24
+DEFAULT_INDEX_HASHES = 7
+
+_HEADER = struct.Struct(">4sII")
+_MAGIC = b"TBF1"
+
+
+def row_key_index_path(iso_date):
+    return f"{ROW_KEY_INDEX_PREFIX}/{iso_date}.bloom"
+
+
+class RowKeyBloomFilter:
+    """
+    Bloom filter over SHA256 hex row keys.  The keys are already uniform
+    hashes, so the bit positions are derived from the key itself with
+    double hashing instead of rehashing it.
+    """
+
+    def __init__(self, num_bits=DEFAULT_INDEX_BITS, num_hashes=DEFAULT_INDEX_HASHES, bits=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray((num_bits + 7) // 8) if bits is None else bytearray(bits)
+
+    def _positions(self, row_key):
+        h1 = int(row_key[0:16], 16)
+        h2 = int(row_key[16:32], 16) | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, row_key):
+        for pos in self._positions(row_key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, row_key):
+        return all(
+            self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(row_key)
+        )
+
+    def update(self, other):
+        """Merge `other` into this filter.  Both must share their sizing."""
+        if (self.num_bits, self.num_hashes) != (other.num_bits, other.num_hashes):
+            raise ValueError("Cannot merge Bloom filters of different sizes")
+        merged = int.from_bytes(self.bits, "little") | int.from_bytes(other.bits, "little")
+        self.bits = bytearray(merged.to_bytes(len(self.bits), "little"))
+        return self
+
+    def to_bytes(self):
+        return _HEADER.pack(_MAGIC, self.num_bits, self.num_hashes) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, num_bits, num_hashes = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("Not a row key index")
+        return cls(num_bits, num_hashes, data[_HEADER.size:])
+
+
+def load_row_key_indexes(iso_date, days, bucket=ROW_KEY_INDEX_BUCKET):
+    """
+    Merge the row key indexes published for the `days` days up to and
+    including `iso_date` (YYYYMMDD) into one filter.  Returns None
+    unless every day has an index: the rows of a load which did not
+    publish one would be missing from the filter.
+    """
+    from datetime import datetime, timedelta
+    from google.cloud import storage
+
+    end = datetime.strptime(iso_date, "%Y%m%d")
+    wanted = {
+        row_key_index_path((end - timedelta(days=i)).strftime("%Y%m%d"))
+        for i in range(days)
+    }
+
+    client = storage.Client()
+    blobs = [
+        blob
+        for blob in client.list_blobs(bucket, prefix=f"{ROW_KEY_INDEX_PREFIX}/")
+        if blob.name in wanted
+    ]
+    if len(blobs) < len(wanted):
+        print(f"Row key indexes missing for {len(wanted) - len(blobs)} of the last {days} days")
+        return None
+
+    merged = None
+    for blob in blobs:
+        index = RowKeyBloomFilter.from_bytes(blob.download_as_string())
+        merged = index if merged is None else merged.update(index)
+    return merged
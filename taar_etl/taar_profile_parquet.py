@@ -0,0 +1,121 @@
+"""
+Columnar export of the sampled TAAR profiles.
+
+Each Avro shard of the profile export is flattened with
+`explode_active_addons` into one row per client with parallel per-addon
+list columns, and written as a Parquet file with dictionary encoded
+string columns.  Records are converted in batches of `batch_size` rows,
+each batch becoming one row group, so memory use is bounded by the
+batch size rather than the shard size.
+"""
+
+import os
+import tempfile
+
+STRING_COLUMNS = ("client_id", "geo_city", "locale", "os")
+INT_COLUMNS = (
+    "bookmark_count",
+    "tab_open_count",
+    "total_uri",
+    "unique_tlds",
+    "subsession_length",
+)
+ADDON_COLUMNS = (
+    ("addon_addon_id", "string"),
+    ("addon_blocklisted", "bool_"),
+    ("addon_name", "string"),
+    ("addon_user_disabled", "bool_"),
+    ("addon_app_disabled", "bool_"),
+    ("addon_version", "string"),
+    ("addon_scope", "int64"),
+    ("addon_type", "string"),
+    ("addon_foreign_install", "bool_"),
+    ("addon_has_binary_components", "bool_"),
+    ("addon_install_day", "int64"),
+    ("addon_update_day", "int64"),
+    ("addon_signed_state", "int64"),
+    ("addon_is_system", "bool_"),
+    ("addon_is_web_extension", "bool_"),
+    ("addon_multiprocess_compatible", "bool_"),
+)
+
+
+def profile_schema():
+    import pyarrow as pa
+
+    fields = [pa.field(name, pa.string()) for name in STRING_COLUMNS]
+    fields += [pa.field(name, pa.int64()) for name in INT_COLUMNS]
+    fields += [
+        pa.field(name, pa.list_(getattr(pa, type_name)()))
+        for name, type_name in ADDON_COLUMNS
+    ]
+    return pa.schema(fields)
+
+
+def to_table(batch, schema):
+    import pyarrow as pa
+
+    columns = {name: [row[name] for row in batch] for name in schema.names}
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def write_parquet(records, where, batch_size=10000):
+    """
+    Flatten `records` and write them as Parquet to `where`, a local path
+    or file object, one row group per `batch_size` records.  Returns the number
+    of rows written.
+    """
+    import pyarrow.parquet as pq
+    from taar_etl.taar_profile_bigtable import explode_active_addons
+
+    schema = profile_schema()
+    rows = 0
+    # Parquet falls back to plain encoding on its own for high
+    # cardinality columns such as client_id
+    with pq.ParquetWriter(
+        where, schema, use_dictionary=True, compression="snappy"
+    ) as writer:
+        batch = []
+        for record in records:
+            batch.append(explode_active_addons(record))
+            if len(batch) >= batch_size:
+                writer.write_table(to_table(batch, schema))
+                rows += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(to_table(batch, schema))
+            rows += len(batch)
+    return rows
+
+
+def export_parquet(shards, output_prefix, batch_size=10000):
+    """
+    Write one Parquet file per Avro shard to `output_prefix`, which is
+    either a local directory or a `gs://<bucket>/<prefix>` URI.  Returns
+    the list of files written.
+    """
+    from taar_etl.taar_profile_bulk_load import iter_shard_records
+
+    written = []
+    for shard in shards:
+        fname = os.path.basename(shard).replace(".avro.", ".parquet.")
+        if output_prefix.startswith("gs://"):
+            from google.cloud import storage
+
+            bucket, _, prefix = output_prefix[len("gs://"):].partition("/")
+            path = f"{prefix.rstrip('/')}/{fname}" if prefix else fname
+            # Stage the file on local disk: the GCS client only uploads
+            # complete files.
+            with tempfile.NamedTemporaryFile(suffix=".parquet") as tmp:
+                rows = write_parquet(iter_shard_records(shard), tmp.name, batch_size)
+                blob = storage.Client().bucket(bucket).blob(path)
+                blob.chunk_size = 5 * 1024 * 1024  # Set 5 MB blob size
+                blob.upload_from_filename(tmp.name)
+            destination = f"gs://{bucket}/{path}"
+        else:
+            os.makedirs(output_prefix, exist_ok=True)
+            destination = os.path.join(output_prefix, fname)
+            rows = write_parquet(iter_shard_records(shard), destination, batch_size)
+        print(f"Wrote {rows} profiles to {destination}")
+        written.append(destination)
+    return written
@@ -0,0 +1,235 @@
+"""
+Load generator for the read path of the TAAR profile table.
+
+For each payload codec the same seeded synthetic profiles are written
+to a table of their own, then random row keys are read concurrently
+the way the TAAR profile fetcher reads them: the latest
+`profile:payload` cell is fetched, decompressed and decoded.  The
+throughput and the latency percentiles and histogram of the reads,
+the decodes and both together are reported per codec.
+
+Run it against the BigTable emulator (set BIGTABLE_EMULATOR_HOST) to
+compare payload formats before they are rolled out.  `--table-id`
+benchmarks the rows of an existing table instead.
+"""
+
+import bisect
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from taar_etl.taar_profile_benchmark import codec_options, usable_codecs
+from taar_etl.taar_profile_codec import (
+    CODECS,
+    decode_payload,
+    get_codec,
+    profile_payload,
+    register_decoder,
+)
+from taar_etl.taar_profile_verify import latency_summary, read_payload
+
+# Upper bounds of the histogram buckets, in milliseconds
+HISTOGRAM_BOUNDS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def latency_histogram(latencies, bounds=HISTOGRAM_BOUNDS_MS):
+    """Count `latencies` (in seconds) per bucket of `bounds` (in ms)."""
+    counts = [0] * (len(bounds) + 1)
+    for latency in latencies:
+        counts[bisect.bisect_left(bounds, latency * 1000)] += 1
+    labels = [f"<={bound}ms" for bound in bounds] + [f">{bounds[-1]}ms"]
+    return dict(zip(labels, counts))
+
+
+def create_benchmark_table(instance, table_id):
+    """(Re)create `table_id` with the column family of the profile table."""
+    from google.cloud.bigtable import column_family
+
+    table = instance.table(table_id)
+    if table.exists():
+        table.delete()
+    table.create(column_families={"profile": column_family.MaxVersionsGCRule(1)})
+    return table
+
+
+def populate(table, records, payload_codec, codec_options, batch_size=500):
+    """
+    Write `records` to `table` with `payload_codec`.  Returns their row keys.
+
+    :raises RuntimeError: some rows could not be written.
+    """
+    import datetime
+    from taar_etl.taar_profile_transforms import CreateBigTableRowsFn
+    from taar_etl.taar_profile_throttle import mutate_rows_with_backoff
+
+    row_builder = CreateBigTableRowsFn(datetime.datetime.utcnow(), payload_codec, codec_options)
+    row_builder.setup()
+    row_keys = []
+    failed = 0
+    batch = []
+    for record in records:
+        batch.extend(row_builder.process(record))
+        if len(batch) >= batch_size:
+            failed += mutate_rows_with_backoff(table, batch)[0]
+            row_keys.extend(row.row_key for row in batch)
+            batch = []
+    if batch:
+        failed += mutate_rows_with_backoff(table, batch)[0]
+        row_keys.extend(row.row_key for row in batch)
+    if failed:
+        raise RuntimeError(f"{failed} of {len(row_keys)} rows could not be written to {table.table_id}")
+    return row_keys
+
+
+def scan_row_keys(table, limit):
+    """Row keys of the first `limit` rows of `table`, without their cells."""
+    from google.cloud.bigtable import row_filters
+
+    rows = table.read_rows(limit=limit, filter_=row_filters.StripValueTransformerFilter(True))
+    return [row.row_key for row in rows]
+
+
+def run_reads(table, row_keys, reads, concurrency, seed):
+    """
+    Read and decode `reads` random rows of `row_keys` with
+    `concurrency` threads and summarize the latencies.
+    """
+    rnd = random.Random(seed)
+    keys = [rnd.choice(row_keys) for _ in range(reads)]
+
+    def lookup(row_key):
+        payload, read_latency = read_payload(table, row_key)
+        start = time.perf_counter()
+        if payload is not None:
+            decode_payload(payload)
+        return read_latency, time.perf_counter() - start, payload is None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lookup, keys))
+    elapsed = time.perf_counter() - start
+
+    read_latencies = [read for read, _, _ in results]
+    decode_latencies = [decode for _, decode, _ in results]
+    total_latencies = [read + decode for read, decode, _ in results]
+    return {
+        "reads": len(results),
+        "missing": sum(1 for _, _, missing in results if missing),
+        "reads_per_sec": len(results) / max(elapsed, 1e-9),
+        "read_ms": latency_summary(read_latencies),
+        "decode_ms": latency_summary(decode_latencies),
+        "total_ms": latency_summary(total_latencies),
+        "histogram": latency_histogram(total_latencies),
+    }
+
+
+def format_ms(value):
+    return "       -" if value is None else f"{value:8.3f}"
+
+
+def print_result(label, result):
+    print(f"{label}: {result['reads_per_sec']:.0f} reads/sec, {result['missing']} missing")
+    for name in ("read_ms", "decode_ms", "total_ms"):
+        summary = result[name]
+        print(
+            f"  {name:<10} p50 {format_ms(summary['p50'])}  p90 {format_ms(summary['p90'])}  "
+            f"p99 {format_ms(summary['p99'])}  max {format_ms(summary['max'])}"
+        )
+    for bucket, count in result["histogram"].items():
+        print(f"  {bucket:>10} {count}")
+
+
+@click.command()
+@click.option("--project", default="test-project", help="GCP project of the BigTable instance")
+@click.option("--instance-id", default="test-instance", help="BigTable instance")
+@click.option("--table-id", help="Benchmark the rows of this existing table instead of synthetic tables")
+@click.option(
+    "--table-prefix",
+    default="taar_profile_read_benchmark",
+    help="Prefix of the table created for each codec",
+)
+@click.option(
+    "--codec",
+    "codecs",
+    multiple=True,
+    type=click.Choice(sorted(CODECS)),
+    help="Codec to benchmark, can be repeated. All codecs by default.",
+)
+@click.option(
+    "--rows",
+    type=click.IntRange(min=1),
+    default=10000,
+    help="Profiles written to, or scanned from, each table",
+)
+@click.option("--reads", type=click.IntRange(min=1), default=20000, help="Random reads per table")
+@click.option("--concurrency", type=click.IntRange(min=1), default=16, help="Concurrent reads")
+@click.option("--seed", type=int, default=42)
+@click.option("--zstd-dict", help="Local zstd dictionary needed to decode zstd-dict payloads of --table-id")
+@click.option(
+    "--addon-vocabulary",
+    help="Local addon vocabulary JSON needed to decode msgpack-addon-ids payloads of --table-id",
+)
+@click.option("--keep-tables", is_flag=True, default=False, help="Keep the synthetic tables afterwards")
+@click.option("--json-output", help="Write the results as JSON to this path")
+def main(
+        project,
+        instance_id,
+        table_id,
+        table_prefix,
+        codecs,
+        rows,
+        reads,
+        concurrency,
+        seed,
+        zstd_dict,
+        addon_vocabulary,
+        keep_tables,
+        json_output,
+):
+    from google.cloud import bigtable
+    from taar_etl.taar_profile_synthetic import SyntheticProfiles
+
+    client = bigtable.Client(project=project, admin=True)
+    instance = client.instance(instance_id)
+    results = {}
+
+    if table_id:
+        if zstd_dict:
+            with open(zstd_dict, "rb") as fin:
+                register_decoder(get_codec("zstd-dict", dictionary=fin.read()))
+        if addon_vocabulary:
+            with open(addon_vocabulary) as fin:
+                register_decoder(get_codec("msgpack-addon-ids", vocabulary=json.load(fin)))
+        table = instance.table(table_id)
+        row_keys = scan_row_keys(table, rows)
+        if not row_keys:
+            raise click.ClickException(f"Table {table_id} has no rows to read")
+        results[table_id] = run_reads(table, row_keys, reads, concurrency, seed)
+        print_result(table_id, results[table_id])
+    else:
+        records = list(SyntheticProfiles(rows, seed=seed))
+        profiles = [profile_payload(record) for record in records]
+        options_by_codec = codec_options(profiles)
+        for name in usable_codecs(options_by_codec, codecs):
+            options = options_by_codec.get(name, {})
+            register_decoder(get_codec(name, **options))
+            table = create_benchmark_table(instance, f"{table_prefix}_{name.replace('-', '_')}")
+            try:
+                row_keys = populate(table, records, name, options)
+                results[name] = run_reads(table, row_keys, reads, concurrency, seed)
+            finally:
+                if not keep_tables:
+                    table.delete()
+            print_result(name, results[name])
+
+    if json_output:
+        with open(json_output, "w") as fout:
+            json.dump(results, fout, indent=2, sort_keys=True)
+        print(f"Wrote results to {json_output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Run several stages of taar_profile_bigtable in one process.
+
+Each completed stage leaves a JSON completion marker in the Avro GCS
+bucket, next to the Avro files of the same date:
+
+    gs://<avro-gcs-bucket>/taar-profile-markers.<YYYYMMDD>/<stage>.json
+
+The marker records a fingerprint of the stage's inputs (its options,
+the SQL it runs, the Avro shards it reads).  When the pipeline is run
+again for the same date, for instance by a DAG retry, stages whose
+marker matches their current inputs are skipped as long as their
+outputs are still there for the stages that follow.
+"""
+
+import hashlib
+import json
+
+from taar_etl.taar_profile_bigtable import list_avro_shard_checksums
+
+# The daily profile pipeline, in order
+PIPELINE_STAGES = (
+    "fill-bq",
+    "bq-to-gcs",
+    "gcs-to-bigtable",
+    "wipe-bigquery-tmp-table",
+)
+
+
+class StageOrchestrator:
+    def __init__(self, extractor):
+        self._extractor = extractor
+
+    def marker_path(self, stage):
+        return f"taar-profile-markers.{self._extractor.ISODATE_NODASH}/{stage}.json"
+
+    def read_marker(self, stage):
+        from google.api_core.exceptions import NotFound
+        from taar_etl.taar_utils import read_bytes_from_gcs
+
+        try:
+            return json.loads(
+                read_bytes_from_gcs(self._extractor.GCS_BUCKET, self.marker_path(stage))
+            )
+        except NotFound:
+            return None
+
+    def write_marker(self, stage, fingerprint):
+        import datetime
+        from taar_etl.taar_utils import store_bytes_to_gcs
+
+        marker = {
+            "stage": stage,
+            "iso_date": self._extractor.ISODATE_NODASH,
+            "fingerprint": fingerprint,
+            "completed_at": datetime.datetime.utcnow().isoformat(),
+        }
+        store_bytes_to_gcs(
+            self._extractor.GCS_BUCKET,
+            self.marker_path(stage),
+            json.dumps(marker).encode("utf8"),
+        )
+
+    def avro_shards(self):
+        """Name and MD5 of every Avro shard of the date."""
+        return list_avro_shard_checksums(
+            self._extractor.GCS_BUCKET, self._extractor.ISODATE_NODASH
+        )
+
+    def stage_inputs(self, stage, config=None):
+        extractor = self._extractor
+        table_id = (
+            f"{extractor.GCP_PROJECT}.{extractor.BIGQUERY_DATASET_ID}."
+            f"{extractor.BIGQUERY_TABLE_ID}"
+        )
+        reads_table = stage in ("bq-to-gcs", "build-addon-vocabulary", "wipe-bigquery-tmp-table") or (
+            stage == "gcs-to-bigtable" and (config or {}).get("source") == "bigquery-storage"
+        )
+        if stage == "fill-bq":
+            return {"sql": extractor.insert_sql()}
+        if reads_table:
+            # The table read (or wiped) is whatever the last fill-bq produced
+            fill_marker = self.read_marker("fill-bq") or {}
+            return {
+                "table": table_id,
+                "fill-bq": [fill_marker.get("fingerprint"), fill_marker.get("completed_at")],
+            }
+        if stage in ("gcs-to-bigtable", "gcs-to-bigtable-local", "gcs-to-parquet", "train-zstd-dict"):
+            return {"avro_shards": self.avro_shards()}
+        if stage == "verify-bigtable":
+            # Verify again whenever the table was loaded again
+            load_marker = (
+                self.read_marker("gcs-to-bigtable")
+                or self.read_marker("gcs-to-bigtable-local")
+                or {}
+            )
+            return {"avro_shards": self.avro_shards(), "load": load_marker.get("completed_at")}
+        return {}
+
+    def input_fingerprint(self, stage, config):
+        content = json.dumps(
+            {"stage": stage, "config": config, "inputs": self.stage_inputs(stage, config)},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(content.encode("utf8")).hexdigest()
+
+    def is_done(self, stage, config):
+        """Whether the marker of `stage` matches its current inputs."""
+        marker = self.read_marker(stage)
+        return marker is not None and marker["fingerprint"] == self.input_fingerprint(stage, config)
+
+    def output_valid(self, stage):
+        """Check that the outputs later stages read are still in place."""
+        extractor = self._extractor
+        if stage == "fill-bq":
+            from google.api_core.exceptions import NotFound
+            from google.cloud import bigquery
+
+            try:
+                bigquery.Client().get_table(
+                    f"{extractor.GCP_PROJECT}.{extractor.BIGQUERY_DATASET_ID}."
+                    f"{extractor.BIGQUERY_TABLE_ID}"
+                )
+            except NotFound:
+                return False
+            return True
+        if stage == "bq-to-gcs":
+            return len(self.avro_shards()) > 0
+        return True
+
+    def run(self, stages, actions, configs=None):
+        """
+        Run `stages` in order.  `actions` maps each stage to a callable
+        running it, `configs` maps stages to the options which affect
+        their output.
+        """
+        configs = configs or {}
+        for i, stage in enumerate(stages):
+            fingerprint = self.input_fingerprint(stage, configs.get(stage))
+            marker = self.read_marker(stage)
+            if marker is not None and marker["fingerprint"] == fingerprint:
+                # Outputs only matter if a later stage still has to run
+                later_done = all(
+                    self.is_done(later, configs.get(later)) for later in stages[i + 1:]
+                )
+                if later_done or self.output_valid(stage):
+                    print(f"Skipping {stage}: completed at {marker['completed_at']}")
+                    continue
+
+            print(f"Running stage {stage}")
+            actions[stage]()
+            self.write_marker(stage, fingerprint)
+            print(f"Stage {stage} completed")
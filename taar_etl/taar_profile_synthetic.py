@@ -0,0 +1,211 @@
+"""
+Seeded synthetic profiles shaped like the Avro export of
+taar_profile_bigtable, i.e. the sampled columns of clients_last_seen.
+
+Addon counts are skewed (most clients have a handful of addons, a few
+have dozens), addon GUIDs are drawn from a Zipf distribution over a
+fixed vocabulary so that a few addons are installed by most clients,
+and nullable columns are left null at `null_rate`.  The same seed
+always produces the same records, so benchmark runs on different
+revisions of the code see identical input.
+
+Records can be written as Avro shards named like the BigQuery export,
+which `--local-avro-glob` of taar_profile_bigtable reads directly.
+"""
+
+import bisect
+import itertools
+import os
+import random
+
+import click
+
+# Avro schema of the BigQuery export of the temporary profile table
+PROFILE_AVRO_SCHEMA = {
+    "type": "record",
+    "name": "Root",
+    "fields": [
+        {"name": "client_id", "type": ["null", "string"]},
+        {"name": "geo_city", "type": ["null", "string"]},
+        {"name": "subsession_length", "type": ["null", "long"]},
+        {"name": "locale", "type": ["null", "string"]},
+        {"name": "os", "type": ["null", "string"]},
+        {
+            "name": "active_addons",
+            "type": {
+                "type": "array",
+                "items": {
+                    "type": "record",
+                    "name": "active_addons",
+                    "fields": [
+                        {"name": "addon_id", "type": ["null", "string"]},
+                        {"name": "blocklisted", "type": ["null", "boolean"]},
+                        {"name": "name", "type": ["null", "string"]},
+                        {"name": "user_disabled", "type": ["null", "boolean"]},
+                        {"name": "app_disabled", "type": ["null", "boolean"]},
+                        {"name": "version", "type": ["null", "string"]},
+                        {"name": "scope", "type": ["null", "long"]},
+                        {"name": "type", "type": ["null", "string"]},
+                        {"name": "foreign_install", "type": ["null", "boolean"]},
+                        {"name": "has_binary_components", "type": ["null", "boolean"]},
+                        {"name": "install_day", "type": ["null", "long"]},
+                        {"name": "update_day", "type": ["null", "long"]},
+                        {"name": "signed_state", "type": ["null", "long"]},
+                        {"name": "is_system", "type": ["null", "boolean"]},
+                        {"name": "is_web_extension", "type": ["null", "boolean"]},
+                        {"name": "multiprocess_compatible", "type": ["null", "boolean"]},
+                    ],
+                },
+            },
+        },
+        {"name": "bookmark_count", "type": ["null", "double"]},
+        {"name": "tab_open_count", "type": ["null", "double"]},
+        {"name": "total_uri", "type": ["null", "double"]},
+        {"name": "unique_tlds", "type": ["null", "double"]},
+    ],
+}
+
+CITIES = ("Toronto", "Berlin", "Paris", "London", "New York", "Tokyo", "??")
+LOCALES = ("en-US", "de", "fr", "en-GB", "es-ES", "ja", "pt-BR", "ru")
+OPERATING_SYSTEMS = ("Windows_NT", "Darwin", "Linux")
+OS_WEIGHTS = (80, 12, 8)
+
+# The most popular addons of the vocabulary are system addons
+SYSTEM_ADDONS = 10
+MAX_ADDONS = 60
+
+
+class SyntheticProfiles:
+    """
+    Generator of synthetic profiles.  Iterating over an instance yields
+    `rows` records and always the same ones for a given seed.
+    """
+
+    def __init__(
+            self,
+            rows,
+            seed=42,
+            mean_addons=6,
+            vocabulary_size=5000,
+            null_rate=0.02,
+            zipf_exponent=1.1,
+    ):
+        self.rows = rows
+        self.seed = seed
+        self.mean_addons = mean_addons
+        self.vocabulary_size = vocabulary_size
+        self.null_rate = null_rate
+
+        self._vocabulary = [
+            (f"addon-{rank}@example.com", f"Addon {rank}", rank < SYSTEM_ADDONS)
+            for rank in range(vocabulary_size)
+        ]
+        self._cum_weights = list(
+            itertools.accumulate(
+                1.0 / (rank + 1) ** zipf_exponent for rank in range(vocabulary_size)
+            )
+        )
+
+    def _nullable(self, rnd, value):
+        return None if rnd.random() < self.null_rate else value
+
+    def _addon_ranks(self, rnd):
+        # Exponentially distributed counts: at least one addon (clients
+        # without addons are not exported) and a long tail
+        count = min(int(rnd.expovariate(1.0 / self.mean_addons)) + 1, MAX_ADDONS)
+        count = min(count, self.vocabulary_size)
+        ranks = set()
+        while len(ranks) < count:
+            pick = rnd.random() * self._cum_weights[-1]
+            ranks.add(bisect.bisect_left(self._cum_weights, pick))
+        return sorted(ranks)
+
+    def _addon(self, rnd, rank):
+        guid, name, is_system = self._vocabulary[rank]
+        install_day = 17000 + rnd.randint(0, 2000)
+        return {
+            "addon_id": guid,
+            "blocklisted": False,
+            "name": self._nullable(rnd, name),
+            "user_disabled": rnd.random() < 0.05,
+            "app_disabled": False,
+            "version": self._nullable(rnd, f"{rnd.randint(1, 9)}.{rnd.randint(0, 20)}.0"),
+            "scope": 1,
+            "type": "extension",
+            "foreign_install": False,
+            "has_binary_components": False,
+            "install_day": install_day,
+            "update_day": install_day + rnd.randint(0, 300),
+            "signed_state": 2 if not is_system else 3,
+            "is_system": is_system,
+            "is_web_extension": True,
+            "multiprocess_compatible": True,
+        }
+
+    def _count(self, rnd, mean):
+        return self._nullable(rnd, float(int(rnd.expovariate(1.0 / mean))))
+
+    def profile(self, rnd):
+        return {
+            "client_id": f"{rnd.getrandbits(128):032x}",
+            "geo_city": self._nullable(rnd, rnd.choice(CITIES)),
+            "subsession_length": self._nullable(rnd, rnd.randint(0, 100000)),
+            "locale": self._nullable(rnd, rnd.choice(LOCALES)),
+            "os": self._nullable(rnd, rnd.choices(OPERATING_SYSTEMS, OS_WEIGHTS)[0]),
+            "active_addons": [self._addon(rnd, rank) for rank in self._addon_ranks(rnd)],
+            "bookmark_count": self._count(rnd, 100),
+            "tab_open_count": self._count(rnd, 150),
+            "total_uri": self._count(rnd, 1500),
+            "unique_tlds": self._count(rnd, 30),
+        }
+
+    def __iter__(self):
+        rnd = random.Random(self.seed)
+        for _ in range(self.rows):
+            yield self.profile(rnd)
+
+    def __len__(self):
+        return self.rows
+
+
+def write_avro_shards(records, output_dir, iso_date, rows_per_shard=100000):
+    """
+    Write `records` as Avro shards named like the BigQuery export of
+    `iso_date` into `output_dir`.  Returns the paths written.
+    """
+    import fastavro
+    from taar_etl.taar_profile_bigtable import avro_shard_prefix
+
+    os.makedirs(output_dir, exist_ok=True)
+    schema = fastavro.parse_schema(PROFILE_AVRO_SCHEMA)
+    records = iter(records)
+    written = []
+    for shard in itertools.count():
+        batch = list(itertools.islice(records, rows_per_shard))
+        if not batch:
+            break
+        path = os.path.join(output_dir, f"{avro_shard_prefix(iso_date)}{shard:012d}")
+        with open(path, "wb") as fout:
+            fastavro.writer(fout, schema, batch)
+        written.append(path)
+    return written
+
+
+@click.command()
+@click.option("--rows", type=int, default=100000, help="Number of profiles")
+@click.option("--seed", type=int, default=42)
+@click.option("--mean-addons", type=float, default=6, help="Mean number of addons per profile")
+@click.option("--null-rate", type=float, default=0.02, help="Rate of null nullable columns")
+@click.option("--rows-per-shard", type=int, default=100000)
+@click.option("--iso-date", default="20200101", help="Date used in the shard names, as YYYYMMDD")
+@click.option("--output-dir", required=True, help="Directory receiving the Avro shards")
+def main(rows, seed, mean_addons, null_rate, rows_per_shard, iso_date, output_dir):
+    profiles = SyntheticProfiles(
+        rows, seed=seed, mean_addons=mean_addons, null_rate=null_rate
+    )
+    for path in write_avro_shards(profiles, output_dir, iso_date, rows_per_shard):
+        print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Client side flow control of the writes and deletes sent to the TAAR
+profile table, so that loads can run while the TAAR service reads the
+same table.
+
+A `WriteBudget` caps the mutations and bytes written per second with
+token buckets.  `shared_budget` returns one budget per process for a
+given configuration, so every bundle and thread of a worker draws from
+the same buckets.  `mutate_rows_with_backoff` sends a batch within the
+budget and retries the rows BigTable throttled or could not serve,
+with exponential backoff.
+"""
+
+import random
+import threading
+import time
+
+# DEADLINE_EXCEEDED, ABORTED, RESOURCE_EXHAUSTED and UNAVAILABLE
+RETRYABLE_CODES = frozenset((4, 10, 8, 14))
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second, holding at most
+    `capacity` tokens (one second worth by default).  Requests larger
+    than the bucket are allowed and leave it in debt, which later
+    requests wait out.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError("Token bucket rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Take `amount` tokens, sleeping until they are paid for."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            self._sleep(wait)
+        return wait
+
+
+class WriteBudget:
+    """Mutations and bytes per second budget.  None means unlimited."""
+
+    def __init__(self, mutations_per_second=None, bytes_per_second=None):
+        self.mutations = TokenBucket(mutations_per_second) if mutations_per_second else None
+        self.bytes = TokenBucket(bytes_per_second) if bytes_per_second else None
+
+    def acquire(self, rows):
+        """Wait until `rows` fit in the budget.  Returns the seconds waited."""
+        waited = 0.0
+        if self.mutations is not None:
+            waited += self.mutations.acquire(len(rows))
+        if self.bytes is not None:
+            waited += self.bytes.acquire(sum(row.get_mutations_size() for row in rows))
+        return waited
+
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def shared_budget(mutations_per_second=None, bytes_per_second=None):
+    """
+    The `WriteBudget` of this process for the given rates, or None if
+    both are unlimited.
+    """
+    if not mutations_per_second and not bytes_per_second:
+        return None
+    key = (mutations_per_second, bytes_per_second)
+    with _budgets_lock:
+        if key not in _budgets:
+            _budgets[key] = WriteBudget(mutations_per_second, bytes_per_second)
+        return _budgets[key]
+
+
+def backoff_delay(attempt, initial_delay=0.5, max_delay=30.0):
+    """Exponential backoff with jitter for retry number `attempt` (from 0)."""
+    return min(max_delay, initial_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def mutate_rows_with_backoff(table, rows, budget=None, max_retries=6, sleep=time.sleep):
+    """
+    Write `rows` with `table.mutate_rows` within `budget`.  Rows which
+    fail with a retryable status, or whole calls rejected as throttled
+    or unavailable, are sent again after an exponential backoff, up to
+    `max_retries` times.
+
+    Returns the number of rows which could not be written and the
+    number of retries.
+    """
+    from google.api_core import exceptions
+
+    retryable_errors = (
+        exceptions.Aborted,
+        exceptions.DeadlineExceeded,
+        exceptions.ResourceExhausted,
+        exceptions.ServiceUnavailable,
+    )
+
+    failed = 0
+    attempt = 0
+    while rows:
+        if budget is not None:
+            budget.acquire(rows)
+        try:
+            statuses = table.mutate_rows(rows)
+        except retryable_errors:
+            retry = rows
+        else:
+            retry = [
+                row for row, status in zip(rows, statuses) if status.code in RETRYABLE_CODES
+            ]
+            failed += sum(
+                1 for status in statuses
+                if status.code != 0 and status.code not in RETRYABLE_CODES
+            )
+        if not retry:
+            break
+        if attempt >= max_retries:
+            failed += len(retry)
+            break
+        sleep(backoff_delay(attempt))
+        attempt += 1
+        rows = retry
+    return failed, attempt
@@ -0,0 +1,286 @@
+"""
+Beam DoFns and CombineFns of the TAAR profile pipelines.
+
+They live apart from taar_profile_bigtable so that the CLI and the
+helpers it shares with the benchmarks and the bulk loader only import
+apache_beam when a pipeline is actually built.
+"""
+
+import apache_beam as beam
+
+from taar_etl.taar_profile_bigtable import (
+    DEFAULT_SORT_BUFFER_SIZE,
+    METRICS_NAMESPACE,
+    PAYLOAD_SIZE_SAMPLE_EVERY,
+)
+from taar_etl.taar_profile_codec import DEFAULT_CODEC
+
+# Errors raised on a record with missing or mistyped values, e.g. a NaN
+# count, by profile_payload and then by the codecs.  Codec setup errors,
+# such as a missing zstd dictionary, are plain ValueErrors of `encode`
+# and fail the bundle instead.
+MALFORMED_RECORD_ERRORS = (KeyError, TypeError, ValueError, OverflowError)
+UNENCODABLE_PROFILE_ERRORS = (TypeError, OverflowError, UnicodeError)
+
+
+class BuildRowKeyIndexFn(beam.CombineFn):
+    """
+    Combine row keys into a serialized `RowKeyBloomFilter`.
+    """
+
+    def __init__(self, num_bits):
+        beam.CombineFn.__init__(self)
+        self._num_bits = num_bits
+
+    def create_accumulator(self):
+        from taar_etl.taar_profile_index import RowKeyBloomFilter
+
+        return RowKeyBloomFilter(self._num_bits)
+
+    def add_input(self, accumulator, row_key):
+        accumulator.add(row_key)
+        return accumulator
+
+    def merge_accumulators(self, accumulators):
+        accumulators = iter(accumulators)
+        merged = next(accumulators)
+        for accumulator in accumulators:
+            merged.update(accumulator)
+        return merged
+
+    def extract_output(self, accumulator):
+        return accumulator.to_bytes()
+
+
+class FilterByRowKeyIndexFn(beam.DoFn):
+    """
+    Drop deletion requests whose hashed client_id is not in the row key
+    index, i.e. which certainly have no profile in BigTable.
+    """
+
+    def __init__(self, index_bytes):
+        beam.DoFn.__init__(self)
+        self._index_bytes = index_bytes
+
+    def setup(self):
+        from apache_beam.metrics import Metrics
+        from taar_etl.taar_profile_codec import profile_row_key
+        from taar_etl.taar_profile_index import RowKeyBloomFilter
+
+        self._row_key = profile_row_key
+        self._index = RowKeyBloomFilter.from_bytes(self._index_bytes)
+        self._deletions_filtered = Metrics.counter(METRICS_NAMESPACE, "deletions_filtered")
+
+    def process(self, element):
+        if self._row_key(element) in self._index:
+            yield element
+        else:
+            self._deletions_filtered.inc()
+
+
+class CreateBigTableRowsFn(beam.DoFn):
+    """
+    Per-worker equivalent of `create_bigtable_rows`.
+
+    Imports and the payload codec are resolved once per worker in
+    `setup` instead of once per row, and every row is stamped with the
+    job level `timestamp` instead of calling `utcnow()` for each record.
+    With the default `json-zlib` codec the payload bytes are identical
+    to the ones written by `create_bigtable_rows`.
+
+    `codec_options` are passed to the codec constructor, e.g. the
+    dictionary of the `zstd-dict` codec.  Malformed records are logged,
+    counted in `rows_failed` and skipped rather than retried forever;
+    `load_bigtable` fails once the job is done if any was skipped.
+    """
+
+    def __init__(self, timestamp, payload_codec=DEFAULT_CODEC, codec_options=None):
+        beam.DoFn.__init__(self)
+        self._timestamp = timestamp
+        self._payload_codec = payload_codec
+        self._codec_options = codec_options or {}
+
+    def setup(self):
+        import json
+        from apache_beam.metrics import Metrics
+        from google.cloud.bigtable import row
+        from taar_etl.taar_profile_codec import get_codec, profile_payload
+
+        self._profile_payload = profile_payload
+        self._codec = get_codec(self._payload_codec, **self._codec_options)
+        self._direct_row = row.DirectRow
+        self._column_family_id = "profile"
+        self._column = "payload".encode()
+
+        self._json_encode = json.JSONEncoder().encode
+        self._rows_seen = 0
+        self._rows_emitted = Metrics.counter(METRICS_NAMESPACE, "rows_emitted")
+        self._rows_failed = Metrics.counter(METRICS_NAMESPACE, "rows_failed")
+        self._payload_bytes = Metrics.distribution(METRICS_NAMESPACE, "payload_bytes")
+        self._raw_payload_bytes = Metrics.distribution(
+            METRICS_NAMESPACE, "raw_payload_bytes"
+        )
+        self._addons_per_client = Metrics.distribution(
+            METRICS_NAMESPACE, "addons_per_client"
+        )
+
+    def _skip(self, message):
+        import logging
+
+        logging.exception(message)
+        self._rows_failed.inc()
+
+    def process(self, element):
+        try:
+            jdata = self._profile_payload(element)
+        except MALFORMED_RECORD_ERRORS:
+            self._skip("Skipping a malformed profile record")
+            return
+        try:
+            payload = self._codec.encode(jdata)
+        except UNENCODABLE_PROFILE_ERRORS:
+            self._skip("Skipping a profile which cannot be encoded")
+            return
+
+        # Serializing the profile only to measure it is not free, so the
+        # size before compression is sampled
+        if self._rows_seen % PAYLOAD_SIZE_SAMPLE_EVERY == 0:
+            self._raw_payload_bytes.update(len(self._json_encode(jdata).encode("utf8")))
+        self._rows_seen += 1
+        self._payload_bytes.update(len(payload))
+        self._addons_per_client.update(len(jdata.get("active_addons") or []))
+
+        direct_row = self._direct_row(row_key=jdata["client_id"])
+        direct_row.set_cell(
+            self._column_family_id,
+            self._column,
+            payload,
+            timestamp=self._timestamp,
+        )
+        self._rows_emitted.inc()
+        yield direct_row
+
+
+class SortRowsByKeyFn(beam.DoFn):
+    """
+    Buffer up to `buffer_size` rows of a bundle and emit them sorted by
+    row key.  WriteToBigTable batches mutations in the order it receives
+    them, so sorted input groups each MutateRows call onto a few
+    neighbouring tablets instead of spreading it across all of them.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_SORT_BUFFER_SIZE):
+        beam.DoFn.__init__(self)
+        self._buffer_size = buffer_size
+
+    def start_bundle(self):
+        self._buffer = []
+
+    def _sorted_rows(self):
+        rows = sorted(self._buffer, key=lambda direct_row: direct_row.row_key)
+        self._buffer = []
+        return rows
+
+    def process(self, element):
+        self._buffer.append(element)
+        if len(self._buffer) >= self._buffer_size:
+            for direct_row in self._sorted_rows():
+                yield direct_row
+
+    def finish_bundle(self):
+        from apache_beam.transforms.window import GlobalWindow
+        from apache_beam.utils.timestamp import MIN_TIMESTAMP
+        from apache_beam.utils.windowed_value import WindowedValue
+
+        for direct_row in self._sorted_rows():
+            yield WindowedValue(direct_row, MIN_TIMESTAMP, [GlobalWindow()])
+
+
+class WriteBigTableRowsFn(beam.DoFn):
+    """
+    Write DirectRows to BigTable in batches of `batch_size`, within a
+    mutations and bytes per second budget shared by every bundle of the
+    worker process.  Rows throttled by BigTable are retried with
+    exponential backoff; a bundle with rows that still fail raises, so
+    that Dataflow retries it.
+    """
+
+    def __init__(
+            self,
+            project_id,
+            instance_id,
+            table_id,
+            mutations_per_second=None,
+            bytes_per_second=None,
+            batch_size=500,
+    ):
+        beam.DoFn.__init__(self)
+        self._project_id = project_id
+        self._instance_id = instance_id
+        self._table_id = table_id
+        self._mutations_per_second = mutations_per_second
+        self._bytes_per_second = bytes_per_second
+        self._batch_size = batch_size
+
+    def setup(self):
+        from apache_beam.metrics import Metrics
+        from google.cloud import bigtable
+        from taar_etl.taar_profile_throttle import shared_budget
+
+        client = bigtable.Client(project=self._project_id)
+        self._table = client.instance(self._instance_id).table(self._table_id)
+        self._budget = shared_budget(self._mutations_per_second, self._bytes_per_second)
+        self._mutations_written = Metrics.counter(METRICS_NAMESPACE, "mutations_written")
+        self._mutations_failed = Metrics.counter(METRICS_NAMESPACE, "mutations_failed")
+        self._write_retries = Metrics.counter(METRICS_NAMESPACE, "write_retries")
+
+    def start_bundle(self):
+        self._batch = []
+
+    def _flush(self):
+        from taar_etl.taar_profile_throttle import mutate_rows_with_backoff
+
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        failed, retries = mutate_rows_with_backoff(self._table, batch, self._budget)
+        self._mutations_written.inc(len(batch) - failed)
+        self._write_retries.inc(retries)
+        if failed:
+            self._mutations_failed.inc(failed)
+            raise RuntimeError(f"{failed} mutations failed to write to BigTable")
+
+    def process(self, element):
+        self._batch.append(element)
+        if len(self._batch) >= self._batch_size:
+            self._flush()
+
+    def finish_bundle(self):
+        self._flush()
+
+
+class LoadShardFn(beam.DoFn):
+    """
+    Write whole Avro shards to BigTable with `load_shard`, then record
+    each of them in the `ShardManifest` of the load.  A shard with
+    failed rows raises, so Dataflow retries it and it is never recorded
+    as loaded.
+
+    `load_args` are the arguments of `load_shard` following the shard.
+    """
+
+    def __init__(self, manifest, load_args):
+        beam.DoFn.__init__(self)
+        self._manifest = manifest
+        self._load_args = load_args
+
+    def process(self, element):
+        from taar_etl.taar_profile_bulk_load import load_shard
+
+        shard, md5 = element
+        result = load_shard(shard, *self._load_args)
+        if result["failed"]:
+            raise RuntimeError(f"{result['failed']} rows of {shard} failed to write to BigTable")
+        self._manifest.mark_loaded(shard, md5, result)
+        print(f"Loaded {shard}: {result['rows']} rows in {result['seconds']:.1f}s")
+        yield shard
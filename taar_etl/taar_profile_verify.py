@@ -0,0 +1,104 @@
+"""
+Read back a sample of the profiles loaded into Cloud BigTable.
+
+Records are sampled from the Avro export, their rows are read from
+BigTable concurrently the way the TAAR profile fetcher reads them,
+and the decoded `profile:payload` cells are compared to the profiles
+the load should have written.  The report counts missing, undecodable
+and mismatched rows and gives the read latency percentiles.
+
+The BigTable client honours BIGTABLE_EMULATOR_HOST, so with local Avro
+files this runs entirely against the BigTable emulator.
+"""
+
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(latencies):
+    """Percentiles, mean and max in milliseconds of `latencies` in seconds."""
+    values = sorted(latency * 1000 for latency in latencies)
+    summary = {f"p{pct}": percentile(values, pct) for pct in LATENCY_PERCENTILES}
+    summary["mean"] = sum(values) / len(values) if values else None
+    summary["max"] = values[-1] if values else None
+    return summary
+
+
+def read_payload(table, row_key):
+    """
+    Read the latest `profile:payload` cell of `row_key`, as the TAAR
+    profile fetcher does.  Returns the payload, or None if the row does
+    not exist, and the read latency in seconds.
+    """
+    from google.cloud.bigtable import row_filters
+
+    start = time.perf_counter()
+    row = table.read_row(row_key, filter_=row_filters.CellsColumnLimitFilter(1))
+    latency = time.perf_counter() - start
+    if row is None:
+        return None, latency
+    return row.cells["profile"][b"payload"][0].value, latency
+
+
+def sample_records(shards, samples, max_shards=4, seed=None):
+    """
+    Reservoir sample `samples` records from up to `max_shards` shards
+    picked at random, so that a sample does not need the whole export.
+    """
+    from taar_etl.taar_profile_bulk_load import iter_shard_records
+
+    rnd = random.Random(seed)
+    picked = rnd.sample(list(shards), min(max_shards, len(shards)))
+    reservoir = []
+    seen = 0
+    for shard in picked:
+        for record in iter_shard_records(shard):
+            seen += 1
+            if len(reservoir) < samples:
+                reservoir.append(record)
+            else:
+                slot = rnd.randrange(seen)
+                if slot < samples:
+                    reservoir[slot] = record
+    return reservoir
+
+
+def verify_profiles(table, records, concurrency=16):
+    """
+    Read back the rows of `records` with `concurrency` threads and
+    compare their decoded payloads to the expected profiles.  Decoders
+    of codecs which need extra state must be registered beforehand.
+    """
+    from taar_etl.taar_profile_codec import decode_payload, profile_payload
+
+    expected = [profile_payload(record) for record in records]
+
+    def check(profile):
+        payload, latency = read_payload(table, profile["client_id"])
+        if payload is None:
+            return "missing", latency
+        try:
+            decoded = decode_payload(payload)
+        except Exception:
+            return "undecodable", latency
+        return ("verified" if decoded == profile else "mismatched"), latency
+
+    report = {"sampled": len(expected), "verified": 0, "missing": 0, "undecodable": 0, "mismatched": 0}
+    latencies = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for outcome, latency in executor.map(check, expected):
+            report[outcome] += 1
+            latencies.append(latency)
+    report["latency_ms"] = latency_summary(latencies)
+    return report
@@ -76,6 +76,26 @@ def read_from_gcs(fname, prefix, bucket):
         return json.loads(payload.decode("utf8"))
 
 
+def store_bytes_to_gcs(bucket, path, byte_data):
+    """Upload raw bytes to gs://<bucket>/<path>."""
+    client = storage.Client()
+    bucket = client.get_bucket(bucket)
+    blob = bucket.blob(path)
+    blob.chunk_size = 5 * 1024 * 1024  # Set 5 MB blob size
+    blob.upload_from_string(byte_data)
+    print(f"Wrote out {path}")
+
+
+def read_bytes_from_gcs(bucket, path):
+    """Download the raw bytes of gs://<bucket>/<path>."""
+    with io.BytesIO() as tmpfile:
+        client = storage.Client()
+        bucket = client.get_bucket(bucket)
+        blob = bucket.blob(path)
+        blob.download_to_file(tmpfile)
+        return tmpfile.getvalue()
+
+
 def load_amo_external_whitelist():
     """ Download and parse the AMO add-on whitelist.
 
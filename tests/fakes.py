@@ -0,0 +1,42 @@
+"""In-memory stand-ins for the BigTable table used by the tests."""
+
+
+def cell_value(direct_row):
+    """The value of the first SetCell mutation of `direct_row`."""
+    mutation = direct_row._get_mutations()[0]
+    # google-cloud-bigtable 1.x keeps protobuf mutations, 2.x its own classes
+    if hasattr(mutation, "set_cell"):
+        return mutation.set_cell.value
+    return mutation.new_value
+
+
+class Status:
+    code = 0
+
+
+class Cell:
+    def __init__(self, value):
+        self.value = value
+
+
+class Row:
+    def __init__(self, value):
+        self.cells = {"profile": {b"payload": [Cell(value)]}}
+
+
+class FakeTable:
+    """Keeps the `profile:payload` cell of every row written."""
+
+    table_id = "profiles"
+
+    def __init__(self):
+        self.payloads = {}
+
+    def mutate_rows(self, rows):
+        for direct_row in rows:
+            self.payloads[direct_row.row_key.decode("utf8")] = cell_value(direct_row)
+        return [Status() for _ in rows]
+
+    def read_row(self, row_key, filter_=None):
+        payload = self.payloads.get(row_key)
+        return None if payload is None else Row(payload)
@@ -0,0 +1,56 @@
+import datetime
+
+import pytest
+
+from taar_etl.taar_profile_benchmark import codec_options, usable_codecs
+from taar_etl.taar_profile_bigtable import create_bigtable_rows
+from taar_etl.taar_profile_codec import decode_payload, get_codec, profile_payload, register_decoder
+from taar_etl.taar_profile_synthetic import SyntheticProfiles
+from taar_etl.taar_profile_transforms import CreateBigTableRowsFn
+
+pytest.importorskip("pytest_benchmark")
+
+ROWS = 2000
+ROUNDS = 5
+
+RECORDS = list(SyntheticProfiles(ROWS, seed=42))
+PROFILES = [profile_payload(record) for record in RECORDS]
+CODEC_OPTIONS = codec_options(PROFILES)
+
+
+def test_create_bigtable_rows(benchmark):
+    def fresh_records():
+        # create_bigtable_rows hashes the client_id in place
+        return ([dict(record) for record in RECORDS],), {}
+
+    benchmark.pedantic(
+        lambda records: [create_bigtable_rows(record) for record in records],
+        setup=fresh_records,
+        rounds=ROUNDS,
+    )
+
+
+@pytest.mark.parametrize("name", usable_codecs(CODEC_OPTIONS))
+def test_create_rows_fn(benchmark, name):
+    dofn = CreateBigTableRowsFn(datetime.datetime.utcnow(), name, CODEC_OPTIONS.get(name))
+    dofn.setup()
+    rows = benchmark.pedantic(
+        lambda: [row for record in RECORDS for row in dofn.process(record)], rounds=ROUNDS
+    )
+    assert len(rows) == ROWS
+
+
+@pytest.mark.parametrize("name", usable_codecs(CODEC_OPTIONS))
+def test_encode(benchmark, name):
+    codec = get_codec(name, **CODEC_OPTIONS.get(name, {}))
+    payloads = benchmark.pedantic(lambda: [codec.encode(profile) for profile in PROFILES], rounds=ROUNDS)
+    benchmark.extra_info["bytes_per_row"] = sum(map(len, payloads)) / len(payloads)
+
+
+@pytest.mark.parametrize("name", usable_codecs(CODEC_OPTIONS))
+def test_decode(benchmark, name):
+    codec = get_codec(name, **CODEC_OPTIONS.get(name, {}))
+    register_decoder(codec)
+    payloads = [codec.encode(profile) for profile in PROFILES]
+    decoded = benchmark.pedantic(lambda: [decode_payload(payload) for payload in payloads], rounds=ROUNDS)
+    assert decoded == PROFILES
@@ -0,0 +1,32 @@
+import datetime
+
+import apache_beam as beam
+from apache_beam.testing.util import assert_that, equal_to
+
+from taar_etl.taar_profile_bigtable import ProfileDataExtraction
+from taar_etl.taar_profile_bq_read import FakeStreamReader
+from taar_etl.taar_profile_codec import decode_payload, profile_row_key
+from taar_etl.taar_profile_synthetic import SyntheticProfiles
+from taar_etl.taar_profile_transforms import CreateBigTableRowsFn
+from tests.fakes import cell_value
+
+
+def decoded_row(direct_row):
+    payload = decode_payload(cell_value(direct_row))
+    return direct_row.row_key.decode("utf8"), payload["active_addons"]
+
+
+def test_storage_read_builds_rows_of_every_record():
+    records = list(SyntheticProfiles(30, seed=11))
+    extractor = ProfileDataExtraction(
+        "20210101", "project", "dataset", "table", "bucket", "instance", "profiles", 0.1, None
+    )
+    expected = [(profile_row_key(record), record["active_addons"]) for record in records]
+
+    with beam.Pipeline(runner="DirectRunner") as p:
+        rows = extractor.read_profiles(
+            p, source="bigquery-storage", read_streams=4, stream_reader=FakeStreamReader(records)
+        ) | "Create rows" >> beam.ParDo(
+            CreateBigTableRowsFn(datetime.datetime.utcnow(), "json-zlib")
+        ) | "Decode rows" >> beam.Map(decoded_row)
+        assert_that(rows, equal_to(expected))
@@ -0,0 +1,57 @@
+import datetime
+from unittest import mock
+
+import click
+import pytest
+
+from taar_etl.taar_profile_bigtable import ProfileDataExtraction
+from taar_etl.taar_profile_bulk_load import load_shard
+from taar_etl.taar_profile_codec import profile_row_key
+from taar_etl.taar_profile_synthetic import SyntheticProfiles, write_avro_shards
+from tests.fakes import FakeTable
+
+
+def run_load_shard(shard, **kwargs):
+    table = FakeTable()
+    with mock.patch("google.cloud.bigtable.Client") as client:
+        client.return_value.instance.return_value.table.return_value = table
+        result = load_shard(
+            shard, "project", "instance", "profiles", datetime.datetime.utcnow(),
+            "json-zlib", {}, 10, 2, **kwargs
+        )
+    return result, table
+
+
+def test_load_shard_skips_row_keys(tmp_path):
+    records = list(SyntheticProfiles(50, seed=1))
+    (shard,) = write_avro_shards(records, str(tmp_path), "20210101")
+    opted_out = {profile_row_key(records[0]), profile_row_key(records[7])}
+
+    result, table = run_load_shard(shard, skip_row_keys=frozenset(opted_out))
+
+    assert result["rows"] == 48
+    assert result["skipped"] == 2
+    assert result["failed"] == 0
+    assert len(table.payloads) == 48
+    assert not opted_out & set(table.payloads)
+
+
+@pytest.mark.parametrize("options", [{"delta": True}, {"source": "bigquery-storage"}])
+def test_local_load_rejects_dataflow_only_options(options):
+    extractor = ProfileDataExtraction(
+        "20210101", "project", "dataset", "table", "bucket", "instance", "profiles", 0.1, None
+    )
+    with pytest.raises(click.UsageError):
+        extractor.load_bigtable_local(**options)
+
+
+def test_load_shard_counts_malformed_records_as_failed(tmp_path):
+    records = list(SyntheticProfiles(20, seed=1))
+    records[3] = dict(records[3], total_uri=float("nan"))
+    (shard,) = write_avro_shards(records, str(tmp_path), "20210101")
+
+    result, table = run_load_shard(shard)
+
+    assert result["rows"] == 19
+    assert result["failed"] == 1
+    assert len(table.payloads) == 19
@@ -0,0 +1,24 @@
+import pytest
+
+from taar_etl.taar_profile_codec import AddonIdsCodec, count_addon_vocabulary
+from taar_etl.taar_profile_synthetic import SyntheticProfiles
+
+
+def test_old_vocabulary_is_loaded_by_id():
+    profiles = list(SyntheticProfiles(200, seed=5))
+    old = count_addon_vocabulary(profiles[:100])
+    new = count_addon_vocabulary(profiles)
+    assert old["id"] != new["id"]
+    payload = AddonIdsCodec(old).encode(profiles[0])
+
+    published = {old["id"]: old}
+    decoder = AddonIdsCodec(new, vocabulary_loader=published.__getitem__)
+
+    assert decoder.decode(payload)["active_addons"] == profiles[0]["active_addons"]
+
+
+def test_unknown_vocabulary_is_rejected():
+    profiles = list(SyntheticProfiles(20, seed=5))
+    payload = AddonIdsCodec(count_addon_vocabulary(profiles)).encode(profiles[0])
+    with pytest.raises(ValueError):
+        AddonIdsCodec().decode(payload)
@@ -0,0 +1,20 @@
+from taar_etl.taar_profile_bigtable import ProfileDataExtraction
+
+
+def extractor():
+    return ProfileDataExtraction(
+        "20210110", "project", "dataset", "table", "bucket", "instance", "profiles", 0.1, None
+    )
+
+
+def test_incremental_delete_only_reads_past_the_watermark():
+    sql, upper = extractor().deletion_requests_sql(28, "2021-01-09T00:00:00.000000+00:00", True)
+    assert upper == "2021-01-11T00:00:00.000000+00:00"
+    assert "DATE_SUB" not in sql
+    assert "TIMESTAMP '2021-01-09T00:00:00.000000+00:00'" in sql
+
+
+def test_window_delete_applies_the_whole_window():
+    sql, _ = extractor().deletion_requests_sql(28, "2021-01-09T00:00:00.000000+00:00", False)
+    assert "INTERVAL 28 DAY" in sql
+    assert "TIMESTAMP '2021-01-09T00:00:00.000000+00:00'" in sql
@@ -0,0 +1,74 @@
+from taar_etl.taar_profile_bigtable import ProfileDataExtraction
+from taar_etl.taar_profile_stages import StageOrchestrator
+
+
+class MemoryOrchestrator(StageOrchestrator):
+    """Markers in a dict, and a temporary table which exists until wiped."""
+
+    def __init__(self, extractor, state):
+        StageOrchestrator.__init__(self, extractor)
+        self.state = state
+
+    def read_marker(self, stage):
+        return self.state["markers"].get(stage)
+
+    def write_marker(self, stage, fingerprint):
+        self.state["runs"] += 1
+        self.state["markers"][stage] = {
+            "fingerprint": fingerprint,
+            "completed_at": f"run-{self.state['runs']}",
+        }
+
+    def avro_shards(self):
+        return [("taar-profile.20210101.avro.0", "md5")]
+
+    def output_valid(self, stage):
+        if stage == "fill-bq":
+            return self.state["table_exists"]
+        return True
+
+
+def extractor(sample_rate=0.1):
+    return ProfileDataExtraction(
+        "20210101", "project", "dataset", "table", "bucket", "instance", "profiles",
+        sample_rate, None,
+    )
+
+
+def new_state():
+    return {"markers": {}, "runs": 0, "table_exists": False}
+
+
+def run(orchestrator, stages, configs=None):
+    ran = []
+
+    def action(stage):
+        def run_stage():
+            ran.append(stage)
+            if stage in ("fill-bq", "wipe-bigquery-tmp-table"):
+                orchestrator.state["table_exists"] = stage == "fill-bq"
+
+        return run_stage
+
+    orchestrator.run(stages, {stage: action(stage) for stage in stages}, configs)
+    return ran
+
+
+def test_wipe_runs_again_after_a_new_fill():
+    stages = ["fill-bq", "bq-to-gcs", "wipe-bigquery-tmp-table"]
+    state = new_state()
+    assert run(MemoryOrchestrator(extractor(0.1), state), stages) == stages
+    assert run(MemoryOrchestrator(extractor(0.1), state), stages) == []
+    assert run(MemoryOrchestrator(extractor(0.2), state), stages) == stages
+
+
+def test_stale_later_marker_does_not_skip_a_wiped_fill():
+    stages = ["fill-bq", "gcs-to-bigtable", "wipe-bigquery-tmp-table"]
+    state = new_state()
+
+    def configs(codec):
+        return {"gcs-to-bigtable": {"source": "bigquery-storage", "payload_codec": codec}}
+
+    assert run(MemoryOrchestrator(extractor(), state), stages, configs("json-zlib")) == stages
+    # The temporary table is gone, so the new load needs a new fill
+    assert run(MemoryOrchestrator(extractor(), state), stages, configs("zstd-dict")) == stages
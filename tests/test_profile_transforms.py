@@ -0,0 +1,31 @@
+import datetime
+
+import pytest
+
+from taar_etl.taar_profile_codec import decode_payload
+from taar_etl.taar_profile_synthetic import SyntheticProfiles
+from taar_etl.taar_profile_transforms import CreateBigTableRowsFn
+from tests.fakes import cell_value
+
+
+def row_builder(payload_codec="json-zlib", codec_options=None):
+    builder = CreateBigTableRowsFn(datetime.datetime.utcnow(), payload_codec, codec_options)
+    builder.setup()
+    return builder
+
+
+def test_rows_decode_to_the_profile():
+    record = next(iter(SyntheticProfiles(1, seed=3)))
+    (direct_row,) = row_builder().process(record)
+    assert decode_payload(cell_value(direct_row))["active_addons"] == record["active_addons"]
+
+
+def test_malformed_records_are_skipped():
+    record = dict(next(iter(SyntheticProfiles(1, seed=3))), total_uri=float("nan"))
+    assert list(row_builder().process(record)) == []
+
+
+def test_codec_setup_errors_are_raised():
+    record = next(iter(SyntheticProfiles(1, seed=3)))
+    with pytest.raises(ValueError):
+        list(row_builder("zstd-dict").process(record))
@@ -0,0 +1,39 @@
+import datetime
+
+from taar_etl.taar_profile_codec import profile_row_key
+from taar_etl.taar_profile_synthetic import SyntheticProfiles
+from taar_etl.taar_profile_transforms import CreateBigTableRowsFn
+from taar_etl.taar_profile_verify import verify_profiles
+from tests.fakes import FakeTable
+
+
+def loaded_table(records):
+    builder = CreateBigTableRowsFn(datetime.datetime.utcnow(), "json-zlib")
+    builder.setup()
+    table = FakeTable()
+    table.mutate_rows([direct_row for record in records for direct_row in builder.process(record)])
+    return table
+
+
+def test_verify_profiles_counts_every_outcome():
+    records = list(SyntheticProfiles(10, seed=2))
+    table = loaded_table(records)
+    keys = [profile_row_key(record) for record in records]
+    del table.payloads[keys[0]]
+    table.payloads[keys[1]] = b"not a payload"
+    table.payloads[keys[2]] = table.payloads[keys[3]]
+
+    report = verify_profiles(table, records, concurrency=4)
+
+    assert report["sampled"] == 10
+    assert report["verified"] == 7
+    assert report["missing"] == 1
+    assert report["undecodable"] == 1
+    assert report["mismatched"] == 1
+    assert report["latency_ms"]["p50"] is not None
+
+
+def test_verify_profiles_of_no_records():
+    report = verify_profiles(FakeTable(), [])
+    assert report["sampled"] == 0
+    assert report["latency_ms"]["p99"] is None